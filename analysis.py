@@ -0,0 +1,138 @@
+import time
+from contextlib import nullcontext
+
+import change_detection
+import local_provider
+import profiling
+import utils
+
+
+def run_analysis(job, aoi, threshold, api_key=None, profile=False):
+    """
+    Runs the full fetch -> classify -> render -> report pipeline for one AOI.
+
+    Designed to run as a background job: progress, status messages and
+    preliminary results are published through `job`, and cancellation is
+    honoured between stages. Returns the analysis results dict the app stores
+    in st.session_state; it includes 'profile_report' when `profile` is set.
+    """
+    import planet_handler
+
+    def publish_preview(preview_ndvi):
+        # Coarse score and map while the full-resolution scene downloads
+        job.check_cancelled()
+        full_rows, full_cols = utils.working_resolution(aoi)
+        preview_degradation, _ = utils.classify_ndvi(preview_ndvi, threshold)
+        job.update(progress=40, preview={
+            'step': max(1, round((full_rows * full_cols / preview_ndvi.size) ** 0.5)),
+            'degradation_percent': preview_degradation,
+            'ndvi_image': utils.render_ndvi_image(preview_ndvi)[0],
+        })
+
+    run_context = profiling.profile_run("analysis") if profile else nullcontext()
+    with run_context as profile_report:
+        job.update(progress=5, message="📡 Step 1/3: Connecting to satellite network...")
+        true_color, ndvi_array, selection = planet_handler.fetch_planet_data(
+            aoi, api_key=api_key, status=lambda message: job.update(message=message), session_id=job.owner,
+            on_preview=publish_preview
+        )
+        job.check_cancelled()
+
+        job.update(progress=60, message="🌿 Step 3/3: Analyzing vegetation health...")
+        degradation_percent, classified_array = utils.classify_ndvi(ndvi_array, threshold)
+
+        # Render the map and build the report as part of the run
+        job.update(progress=85, message="🗺️ Preparing maps and report...")
+        ndvi_render = utils.render_ndvi_image(ndvi_array)
+        job.check_cancelled()
+        report_csv = utils.create_report_csv(aoi, degradation_percent, threshold)
+
+    results = {
+        "degradation_percent": degradation_percent,
+        "true_color_image": true_color,
+        "ndvi_array": ndvi_array,
+        "classified_array": classified_array,
+        "ndvi_render": ndvi_render,
+        "report_csv": report_csv,
+        "scene_summary": planet_handler.describe_scene(selection),
+        "timestamp": time.time(),
+        "threshold": threshold
+    }
+    if profile:
+        results["profile_report"] = profile_report
+    return results
+
+
+def run_local_analysis(job, path, threshold, band_order=local_provider.DEFAULT_BAND_ORDER, aoi=None,
+                       profile=False):
+    """
+    Runs the classify -> render -> report pipeline on a local raster file.
+
+    The file is read window by window (see local_provider), so large scenes
+    are analyzed offline with flat memory; maps are rendered from a
+    decimated preview. Returns the same results dict as run_analysis.
+    """
+    def report_progress(fraction):
+        job.check_cancelled()
+        job.update(progress=10 + int(fraction * 70))
+
+    run_context = profiling.profile_run("local_analysis") if profile else nullcontext()
+    with run_context as profile_report:
+        job.update(progress=5, message="💾 Reading local raster window by window...")
+        summary = local_provider.analyze_local_raster(
+            path, threshold, band_order, aoi=aoi, progress=report_progress
+        )
+        degradation_percent = summary['degradation_percent']
+        ndvi_array = summary['ndvi_preview']
+        _, classified_array = utils.classify_ndvi(ndvi_array, threshold)
+
+        job.update(progress=85, message="🗺️ Preparing maps and report...")
+        ndvi_render = utils.render_ndvi_image(ndvi_array)
+        job.check_cancelled()
+        report_csv = utils.create_report_csv(
+            utils.bounds_polygon(*summary['bounds']), degradation_percent, threshold
+        )
+
+    results = {
+        "degradation_percent": degradation_percent,
+        "true_color_image": summary['rgb_preview'],
+        "ndvi_array": ndvi_array,
+        "classified_array": classified_array,
+        "ndvi_render": ndvi_render,
+        "report_csv": report_csv,
+        "scene_summary": local_provider.describe_local_raster(summary),
+        "timestamp": time.time(),
+        "threshold": threshold
+    }
+    if profile:
+        results["profile_report"] = profile_report
+    return results
+
+
+def run_change_detection(job, aoi, before_date, after_date, threshold=change_detection.CHANGE_THRESHOLD,
+                         api_key=None):
+    """
+    Runs the fetch both dates -> ΔNDVI -> render pipeline for one AOI.
+
+    Runs as a background job like run_analysis. Returns the change results
+    dict the app stores in st.session_state.
+    """
+    def fetch(date, progress):
+        job.update(progress=progress, message=f"🛰️ Fetching imagery up to {date:%Y-%m-%d}...")
+        ndvi = change_detection.get_ndvi_for_date(
+            aoi, date, api_key=api_key, status=lambda message: job.update(message=message), session_id=job.owner
+        )
+        job.check_cancelled()
+        return ndvi
+
+    ndvi_before = fetch(before_date, 5)
+    ndvi_after = fetch(after_date, 45)
+
+    job.update(progress=85, message="🔁 Comparing vegetation between the dates...")
+    delta_display, change_stats = change_detection.detect_change(ndvi_before, ndvi_after, aoi, threshold)
+    return {
+        "change_image": utils.render_change_image(delta_display),
+        "stats": change_stats,
+        "before_date": before_date,
+        "after_date": after_date,
+    }
@@ -1,13 +1,19 @@
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
-import planet_handler as data_handler
 import streamlit as st
-import utils
-import numpy as np
-from PIL import Image
+import metrics
+import profiling
+import change_detection
+import analysis
+import jobs
+import local_provider
 import time
-import matplotlib.cm as cm
+import uuid
+from datetime import date, timedelta
+
+# Seconds between status fragment refreshes while a background analysis is running
+JOB_POLL_SECONDS = 0.5
 
 # --- ENHANCED CSS WITH DARK GREEN THEME ---
 def load_css():
@@ -192,6 +198,9 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# --- METRICS ENDPOINT (started once per process) ---
+metrics_port = metrics.start_http_server()
+
 # --- APP STATE ---
 if 'aoi' not in st.session_state:
     st.session_state.aoi = None
@@ -199,6 +208,23 @@ if 'analysis_results' not in st.session_state:
     st.session_state.analysis_results = None
 if 'analysis_history' not in st.session_state:
     st.session_state.analysis_history = []
+if 'profile_report' not in st.session_state:
+    st.session_state.profile_report = None
+if 'change_results' not in st.session_state:
+    st.session_state.change_results = None
+if 'session_id' not in st.session_state:
+    # A reloaded page keeps its session id so it can resume its own job
+    st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+if 'active_job_id' not in st.session_state:
+    # Resume a background analysis started before a page reload; jobs owned
+    # by another session are treated as unavailable
+    st.session_state.active_job_id = st.query_params.get("job")
+if 'change_job_id' not in st.session_state:
+    st.session_state.change_job_id = st.query_params.get("change_job")
+
+# Debug profiling: the TERRASCAN_PROFILE secret/environment variable, or ?profile=1
+# where the operator allows it with TERRASCAN_PROFILE_ALLOW_QUERY
+debug_profiling = profiling.profiling_requested(st.query_params, st.secrets)
 
 # --- COMPREHENSIVE USER GUIDE ---
 with st.expander("📚 Complete User Guide - Learn How to Use TerraScan", expanded=True):
@@ -372,14 +398,41 @@ with col1:
     with threshold_col2:
         st.metric("Current Setting", f"NDVI {ndvi_threshold}")
 
+    # Reading files off the server is opt-in, so the choice only appears once
+    # a local data directory is configured
+    use_local_file = False
+    if local_provider.LOCAL_DATA_DIR:
+        data_source = st.radio(
+            "**Imagery Source**",
+            ["🛰️ Planet satellite imagery", "💾 Local raster file"],
+            horizontal=True,
+            help="Analyze imagery already in the server's local data directory (NumPy .npy stacks or GeoTIFF) without calling the Planet API."
+        )
+        use_local_file = data_source == "💾 Local raster file"
+    if use_local_file:
+        local_path = st.text_input(
+            "**Local File Path**",
+            placeholder="scenes/scene_4band.tif",
+            help="Relative to the local data directory. GeoTIFFs use their own location. A .npy stack is assumed to cover the area drawn on the map."
+        )
+        local_band_order = st.selectbox("**Band Order**", list(local_provider.BAND_ORDERS))
+
 with col2:
     st.markdown("#### ⚡ Start Analysis")
     analyze_button = st.button("🚀 Start Satellite Analysis", type="primary", use_container_width=True)
     
     st.markdown("#### 🔄 Management")
     if st.button("🔄 Clear Results", use_container_width=True):
+        for job_key in ("active_job_id", "change_job_id"):
+            if st.session_state[job_key]:
+                jobs.cancel(st.session_state[job_key], owner=st.session_state.session_id)
+                st.session_state[job_key] = None
+        for param in ("job", "change_job", "session"):
+            if param in st.query_params:
+                del st.query_params[param]
         st.session_state.aoi = None
         st.session_state.analysis_results = None
+        st.session_state.change_results = None
         st.rerun()
 
 # --- ANALYSIS EXECUTION SECTION ---
@@ -390,76 +443,38 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 if analyze_button:
-    if st.session_state.aoi:
-        # Create placeholders for the progress display
-        progress_placeholder = st.empty()
-        
-        # We will use a single bar and a text element for cleaner updates
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+    if st.session_state.active_job_id:
+        st.info("⏳ An analysis is already running for this session. Cancel it below to start a new one.")
+    elif use_local_file:
+        # Read straight from disk on the worker pool; no API key needed
+        try:
+            st.session_state.active_job_id = jobs.submit(
+                analysis.run_local_analysis, local_path, ndvi_threshold,
+                local_provider.BAND_ORDERS[local_band_order], aoi=st.session_state.aoi,
+                profile=debug_profiling, owner=st.session_state.session_id
+            )
+            st.query_params["job"] = st.session_state.active_job_id
+            st.query_params["session"] = st.session_state.session_id
+        except jobs.JobQueueFull as e:
+            st.warning(f"🚦 **Server busy.** {e}")
+    elif st.session_state.aoi:
+        try:
+            planet_api_key = st.secrets.get("PLANET_API_KEY")
+        except Exception:
+            # No secrets file; the job reports the missing key
+            planet_api_key = None
 
+        # Run the pipeline on the shared worker pool so reruns don't lose it
         try:
-            # Step 1: Connection (Simulated)
-            status_text.info("📡 Step 1/3: Connecting to satellite network...")
-            for i in range(33):
-                progress_bar.progress(i)
-                time.sleep(0.01)
-
-            # Step 2: Data Acquisition (Actual API call happens here)
-            status_text.info("🛰️ Step 2/3: Acquiring latest satellite imagery...")
-            true_color, ndvi_array = data_handler.get_planet_data(st.session_state.aoi)
-            
-            # Update progress after the API call returns
-            for i in range(33, 67):
-                progress_bar.progress(i)
-                time.sleep(0.01)
-
-            # Step 3: Processing
-            status_text.info("🌿 Step 3/3: Analyzing vegetation health...")
-            if ndvi_array is not None and true_color is not None:
-                degradation_percent, classified_array = utils.classify_ndvi(ndvi_array, ndvi_threshold)
-                
-                # Store results
-                st.session_state.analysis_results = {
-                    "degradation_percent": degradation_percent,
-                    "true_color_image": true_color,
-                    "ndvi_array": ndvi_array,
-                    "classified_array": classified_array,
-                    "timestamp": time.time(),
-                    "threshold": ndvi_threshold
-                }
-                
-                # Add to history
-                st.session_state.analysis_history.append({
-                    "degradation": degradation_percent,
-                    "threshold": ndvi_threshold,
-                    "timestamp": time.time()
-                })
-
-                # Finalize progress and show success
-                for i in range(67, 101):
-                    progress_bar.progress(i)
-                    time.sleep(0.01)
-                
-                # Clear the progress elements and show the final message
-                status_text.empty()
-                progress_bar.empty()
-                progress_placeholder.success("""
-                ✅ **Analysis Complete!** Your land health assessment is ready. Scroll down to view the detailed results.
-                """)
-
-            else:
-                # If data_handler returned None, it means an error occurred
-                # The error message is already displayed by data_handler
-                status_text.empty()
-                progress_bar.empty()
-                # We don't need to show another error message here as planet_handler.py does it.
-                
-        except Exception as e:
-            # Catch any unexpected errors during the process
-            status_text.empty()
-            progress_bar.empty()
-            st.error(f"An unexpected error occurred during analysis: {e}")
+            st.session_state.active_job_id = jobs.submit(
+                analysis.run_analysis, st.session_state.aoi, ndvi_threshold,
+                api_key=planet_api_key, profile=debug_profiling,
+                owner=st.session_state.session_id
+            )
+            st.query_params["job"] = st.session_state.active_job_id
+            st.query_params["session"] = st.session_state.session_id
+        except jobs.JobQueueFull as e:
+            st.warning(f"🚦 **Server busy.** {e}")
 
     else:
         st.warning("""
@@ -469,6 +484,86 @@ if analyze_button:
         Use the polygon or rectangle tools to define your region of interest.
         """)
 
+# --- BACKGROUND JOB STATUS ---
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress(job_id, cancel_label="⏹️ Cancel Analysis"):
+    """
+    Shows a queued or running job's progress. Only this fragment reruns
+    while the job is in progress; a full rerun picks up the result.
+    """
+    job = jobs.get(job_id, owner=st.session_state.session_id)
+    if job is None or job.status in jobs.FINISHED_STATES:
+        st.rerun()
+
+    st.progress(job.progress)
+    if job.cancel_requested:
+        st.info("⏹️ Cancelling analysis...")
+    else:
+        st.info(job.message)
+
+    if job.preview:
+        st.metric(
+            f"🔎 Preliminary Health Score (1/{job.preview['step']} resolution)",
+            f"{100 - job.preview['degradation_percent']:.0f}%"
+        )
+        st.image(job.preview['ndvi_image'], use_column_width=True,
+                caption="**Preview** - downloading full resolution...")
+
+    if st.button(cancel_label, key=f"cancel_{job.id}", use_container_width=True, disabled=job.cancel_requested):
+        jobs.cancel(job.id, owner=st.session_state.session_id)
+        st.rerun(scope="fragment")
+
+
+def show_job_failure(job):
+    """
+    Shows why a failed job stopped, with the level its error asked for.
+    """
+    if job.error_level == 'warning':
+        st.warning(job.error)
+    elif job.error_level:
+        st.error(job.error)
+    else:
+        st.error(f"An unexpected error occurred during analysis: {job.error}")
+
+
+if st.session_state.active_job_id:
+    job = jobs.get(st.session_state.active_job_id, owner=st.session_state.session_id)
+
+    if job is not None and job.status not in jobs.FINISHED_STATES:
+        show_job_progress(job.id)
+
+    else:
+        st.session_state.active_job_id = None
+        # ?session= stays while a comparison still needs it to resume
+        finished_params = ("job",) if st.session_state.change_job_id else ("job", "session")
+        for param in finished_params:
+            if param in st.query_params:
+                del st.query_params[param]
+
+        if job is None:
+            # Expired, or the server restarted while the page was away
+            st.info("ℹ️ The previous analysis is no longer available. Please start a new one.")
+        elif job.status == jobs.DONE:
+            results = dict(job.result)
+            st.session_state.profile_report = results.pop("profile_report", None)
+            st.session_state.analysis_results = results
+
+            # Add to history
+            st.session_state.analysis_history.append({
+                "degradation": results["degradation_percent"],
+                "threshold": results["threshold"],
+                "timestamp": results["timestamp"]
+            })
+
+            st.success(results["scene_summary"])
+            st.success("""
+            ✅ **Analysis Complete!** Your land health assessment is ready. Scroll down to view the detailed results.
+            """)
+        elif job.status == jobs.FAILED:
+            show_job_failure(job)
+        else:
+            st.info("⏹️ **Analysis cancelled.**")
+
 # --- RESULTS DISPLAY SECTION ---
 if st.session_state.analysis_results:
     results = st.session_state.analysis_results
@@ -581,21 +676,8 @@ if st.session_state.analysis_results:
         ndvi_display = results['ndvi_array']
         
         if ndvi_display is not None:
-            # Enhanced visualization with a safety check
-            ndvi_min = np.nanmin(ndvi_display)
-            ndvi_max = np.nanmax(ndvi_display)
-            
-            # Check to prevent division by zero if the data is uniform
-            if (ndvi_max - ndvi_min) > 0:
-                ndvi_normalized = (ndvi_display - ndvi_min) / (ndvi_max - ndvi_min)
-            else:
-                # If data is uniform, avoid division and just create a zero array
-                ndvi_normalized = np.zeros_like(ndvi_display)
-
-            ndvi_normalized = np.nan_to_num(ndvi_normalized, nan=0.0)
-            
-            # Convert to PIL Image using a colormap for better visualization
-            ndvi_image = Image.fromarray((cm.viridis(ndvi_normalized) * 255).astype(np.uint8))
+            # Rendered once by the analysis job; reruns reuse the stored image
+            ndvi_image, ndvi_min, ndvi_max = results['ndvi_render']
             
             st.image(ndvi_image, use_column_width=True, 
                     caption=f"**Vegetation Health Visualization** | NDVI Range: {ndvi_min:.3f} to {ndvi_max:.3f}")
@@ -632,9 +714,8 @@ if st.session_state.analysis_results:
     - Progress monitoring
     """)
     
-    # The create_report_csv function returns the data directly.
-    # We assign it to a variable and pass it straight to the download button.
-    csv_data = utils.create_report_csv(st.session_state.aoi, degradation, results['threshold'])
+    # The report is built once by the analysis job and reused on every rerun
+    csv_data = results['report_csv']
 
     st.download_button(
        label="📥 Download Professional Report (CSV)",
@@ -664,6 +745,175 @@ else:
     **💡 Pro Tip:** For agricultural areas, start with NDVI 0.2. For natural vegetation, try 0.15.
     """)
 
+# --- CHANGE DETECTION SECTION ---
+st.markdown("""
+<div class="section-header">
+    <h2>🔁 Compare Two Dates</h2>
+</div>
+""", unsafe_allow_html=True)
+
+st.markdown("""
+**Track land degradation over time.** Choose two dates to compare vegetation in your selected area.
+Green areas gained vegetation, red areas lost it.
+""")
+
+change_col1, change_col2, change_col3 = st.columns([1, 1, 1])
+with change_col1:
+    before_date = st.date_input("**Before**", value=date.today() - timedelta(days=90), max_value=date.today())
+with change_col2:
+    after_date = st.date_input("**After**", value=date.today(), max_value=date.today())
+with change_col3:
+    change_threshold = st.slider(
+        "**Change Sensitivity (ΔNDVI)**",
+        min_value=0.05, max_value=0.5, value=change_detection.CHANGE_THRESHOLD, step=0.05,
+        help="Minimum NDVI difference counted as a gain or loss"
+    )
+
+compare_button = st.button("🔁 Compare Dates", use_container_width=True)
+
+if compare_button:
+    if st.session_state.change_job_id:
+        st.info("⏳ A comparison is already running for this session. Cancel it below to start a new one.")
+    elif not st.session_state.aoi:
+        st.warning("⚠️ **No Area Selected** - Please draw an area on the map above first.")
+    elif before_date >= after_date:
+        st.warning("⚠️ The 'Before' date must be earlier than the 'After' date.")
+    else:
+        try:
+            planet_api_key = st.secrets.get("PLANET_API_KEY")
+        except Exception:
+            # No secrets file; the job reports the missing key
+            planet_api_key = None
+
+        # Both dates are fetched on the shared worker pool, like an analysis
+        try:
+            st.session_state.change_job_id = jobs.submit(
+                analysis.run_change_detection, st.session_state.aoi, before_date, after_date,
+                change_threshold, api_key=planet_api_key, owner=st.session_state.session_id
+            )
+            st.query_params["change_job"] = st.session_state.change_job_id
+            st.query_params["session"] = st.session_state.session_id
+        except jobs.JobQueueFull as e:
+            st.warning(f"🚦 **Server busy.** {e}")
+
+if st.session_state.change_job_id:
+    change_job = jobs.get(st.session_state.change_job_id, owner=st.session_state.session_id)
+
+    if change_job is not None and change_job.status not in jobs.FINISHED_STATES:
+        show_job_progress(change_job.id, cancel_label="⏹️ Cancel Comparison")
+
+    else:
+        st.session_state.change_job_id = None
+        finished_params = ("change_job",) if st.session_state.active_job_id else ("change_job", "session")
+        for param in finished_params:
+            if param in st.query_params:
+                del st.query_params[param]
+
+        if change_job is None:
+            st.info("ℹ️ The previous comparison is no longer available. Please start a new one.")
+        elif change_job.status == jobs.DONE:
+            st.session_state.change_results = change_job.result
+        elif change_job.status == jobs.FAILED:
+            show_job_failure(change_job)
+        else:
+            st.info("⏹️ **Comparison cancelled.**")
+
+if st.session_state.change_results:
+    change_results = st.session_state.change_results
+    change_stats = change_results['stats']
+
+    change_metric1, change_metric2, change_metric3 = st.columns(3)
+    with change_metric1:
+        st.metric("📈 Mean NDVI Change", f"{change_stats['mean_delta']:+.3f}")
+    with change_metric2:
+        st.metric(
+            "🌱 Vegetation Gain",
+            f"{change_stats['gain_percentage']:.1f}%",
+            help=f"About {change_stats.get('gain_area_sq_km', 0):.2f} sq km"
+        )
+    with change_metric3:
+        st.metric(
+            "🏜️ Vegetation Loss",
+            f"{change_stats['loss_percentage']:.1f}%",
+            help=f"About {change_stats.get('loss_area_sq_km', 0):.2f} sq km"
+        )
+
+    st.image(change_results['change_image'], use_column_width=True,
+             caption=f"**NDVI Change** | {change_results['before_date']} → {change_results['after_date']}")
+
+# --- PROFILE DOWNLOAD (debug mode only) ---
+if debug_profiling and st.session_state.profile_report:
+    profile_report = st.session_state.profile_report
+    with st.expander("🧪 Debug Profile - Last Analysis Run", expanded=False):
+        st.write(f"**Wall time:** {profile_report['wall_time']:.2f} s | "
+                 f"**Peak traced memory:** {profile_report['peak_memory_mb']:.1f} MB")
+
+        st.markdown("**Top allocations**")
+        st.table([
+            {
+                "Location": allocation['location'],
+                "Size (KB)": f"{allocation['size_kb']:.1f}",
+                "Blocks": allocation['count'],
+            }
+            for allocation in profile_report['top_allocations']
+        ])
+
+        profile_col1, profile_col2 = st.columns(2)
+        with profile_col1:
+            st.download_button(
+                label="📥 Download CPU Profile (.prof)",
+                data=profile_report['prof_bytes'],
+                file_name=f"TerraScan_Profile_{time.strftime('%Y%m%d_%H%M')}.prof",
+                mime="application/octet-stream",
+                use_container_width=True,
+                help="Open with snakeviz or python -m pstats"
+            )
+        with profile_col2:
+            st.download_button(
+                label="📥 Download Summary (TXT)",
+                data=profiling.format_summary(profile_report),
+                file_name=f"TerraScan_Profile_{time.strftime('%Y%m%d_%H%M')}.txt",
+                mime="text/plain",
+                use_container_width=True
+            )
+
+# --- DIAGNOSTICS PANEL (optional, enabled with ?diagnostics=1) ---
+if st.query_params.get("diagnostics") == "1":
+    with st.expander("🩺 Diagnostics - Pipeline Performance", expanded=False):
+        snapshot = metrics.snapshot()
+
+        st.markdown("**Stage timings (recent samples)**")
+        if snapshot['stages']:
+            st.table([
+                {
+                    "Stage": stage,
+                    "Runs": stats['count'],
+                    "Mean (ms)": f"{stats['mean'] * 1000:.1f}",
+                    "p50 (ms)": f"{stats['p50'] * 1000:.1f}",
+                    "p95 (ms)": f"{stats['p95'] * 1000:.1f}",
+                }
+                for stage, stats in sorted(snapshot['stages'].items())
+            ])
+        else:
+            st.info("No analysis stages have run in this process yet.")
+
+        st.markdown("**Bytes**")
+        for kind, count in sorted(snapshot['bytes'].items()):
+            st.write(f"- {kind}: {count / 1024:.1f} KB")
+
+        st.markdown("**Cache hit ratios**")
+        for cache, stats in sorted(snapshot['caches'].items()):
+            st.write(f"- {cache}: {stats['hit_ratio'] * 100:.0f}% ({stats['hits']} hits / {stats['misses']} misses)")
+
+        st.markdown("**Planet API usage**")
+        for event, count in sorted(snapshot['events'].items()):
+            st.write(f"- {event}: {count}")
+        for name, value in sorted(snapshot['gauges'].items()):
+            st.write(f"- {name}: {value:g}")
+
+        if metrics_port:
+            st.caption(f"Prometheus metrics: http://127.0.0.1:{metrics_port}/metrics")
+
 # --- PROFESSIONAL FOOTER ---
 st.markdown("""
 <div class="custom-footer">
@@ -675,4 +925,4 @@ st.markdown("""
         </p>
     </div>
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
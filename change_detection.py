@@ -0,0 +1,132 @@
+import math
+
+import numpy as np
+
+import metrics
+import utils
+
+# Output tile edge (pixels) for the chunked change pass
+TILE_SIZE = 256
+
+# |ΔNDVI| at or above this counts as gain or loss
+CHANGE_THRESHOLD = 0.1
+
+# Upper bound on the decimated ΔNDVI map kept for display (pixels)
+DISPLAY_PIXELS = 512 * 512
+
+
+def get_ndvi_for_date(aoi, date, api_key=None, status=None, session_id=None):
+    """
+    Returns the NDVI raster for an AOI as of a date.
+
+    Rasters come through planet_handler.fetch_planet_data, which answers from
+    raster_cache whenever a recent raster acquired in the 30 days up to
+    `date` covers the AOI and fetches (and caches) one from Planet otherwise.
+    Safe to call from background jobs; failures raise PlanetDataError.
+    """
+    import planet_handler
+    _, ndvi_array, _ = planet_handler.fetch_planet_data(
+        aoi, end_date=date, api_key=api_key, status=status, session_id=session_id
+    )
+    return ndvi_array
+
+
+def common_grid(shape_a, shape_b):
+    """
+    Returns the shared (rows, cols) grid for two rasters of the same AOI.
+
+    The coarser of the two resolutions is used, so neither raster is upsampled.
+    """
+    return min(shape_a[0], shape_b[0]), min(shape_a[1], shape_b[1])
+
+
+def _source_indices(source_length, grid_length, start, stop):
+    # Nearest-neighbour source pixel for each grid cell centre in [start, stop)
+    centres = (np.arange(start, stop) + 0.5) * (source_length / grid_length)
+    return np.minimum(centres.astype(np.intp), source_length - 1)
+
+
+def _read_tile(raster, grid_shape, row_start, row_stop, col_start, col_stop):
+    rows = _source_indices(raster.shape[0], grid_shape[0], row_start, row_stop)
+    cols = _source_indices(raster.shape[1], grid_shape[1], col_start, col_stop)
+    tile = np.asarray(raster[np.ix_(rows, cols)], dtype=np.float32)
+    tile[tile == -9999] = np.nan
+    return tile
+
+
+def detect_change(ndvi_before, ndvi_after, aoi=None, threshold=CHANGE_THRESHOLD, tile_size=TILE_SIZE,
+                  display_pixels=DISPLAY_PIXELS):
+    """
+    Computes ΔNDVI (after - before) gain/loss statistics tile by tile.
+
+    Both rasters are resampled onto a common grid one tile at a time and the
+    statistics are accumulated per tile, so neither aligned copies of the
+    scenes nor a full-size difference raster are ever allocated; the inputs
+    may be in-memory arrays or memory-mapped files. Returns a decimated
+    float32 ΔNDVI map of at most `display_pixels` for rendering and a
+    statistics dict. Areas in square km are included when `aoi` is given.
+    """
+    grid_shape = common_grid(ndvi_before.shape, ndvi_after.shape)
+    rows, cols = grid_shape
+
+    # Only the pixels on the display grid are kept
+    step = max(1, math.ceil(math.sqrt(rows * cols / display_pixels)))
+    delta_display = np.empty((math.ceil(rows / step), math.ceil(cols / step)), dtype=np.float32)
+
+    valid_pixels = 0
+    gain_pixels = 0
+    loss_pixels = 0
+    delta_sum = 0.0
+    delta_sq_sum = 0.0
+
+    with metrics.span("change_detection"):
+        for row_start in range(0, rows, tile_size):
+            row_stop = min(row_start + tile_size, rows)
+            for col_start in range(0, cols, tile_size):
+                col_stop = min(col_start + tile_size, cols)
+
+                before = _read_tile(ndvi_before, grid_shape, row_start, row_stop, col_start, col_stop)
+                after = _read_tile(ndvi_after, grid_shape, row_start, row_stop, col_start, col_stop)
+
+                # Reuse the `after` tile for the difference
+                delta = np.subtract(after, before, out=after)
+
+                valid = np.isfinite(delta)
+                valid_delta = delta[valid]
+                valid_pixels += valid_delta.size
+                gain_pixels += int(np.count_nonzero(valid_delta >= threshold))
+                loss_pixels += int(np.count_nonzero(valid_delta <= -threshold))
+                delta_sum += float(valid_delta.sum(dtype=np.float64))
+                delta_sq_sum += float(np.square(valid_delta, dtype=np.float64).sum())
+
+                first_row = (-row_start) % step
+                first_col = (-col_start) % step
+                kept = delta[first_row::step, first_col::step]
+                display_row = (row_start + first_row) // step
+                display_col = (col_start + first_col) // step
+                delta_display[display_row:display_row + kept.shape[0], display_col:display_col + kept.shape[1]] = kept
+
+    if valid_pixels:
+        mean_delta = delta_sum / valid_pixels
+        std_delta = np.sqrt(max(delta_sq_sum / valid_pixels - mean_delta ** 2, 0.0))
+    else:
+        mean_delta = std_delta = 0.0
+
+    stats = {
+        'grid_shape': grid_shape,
+        'display_step': step,
+        'valid_pixels': valid_pixels,
+        'mean_delta': mean_delta,
+        'std_delta': float(std_delta),
+        'gain_percentage': gain_pixels / valid_pixels * 100 if valid_pixels else 0.0,
+        'loss_percentage': loss_pixels / valid_pixels * 100 if valid_pixels else 0.0,
+        'threshold': threshold,
+    }
+
+    if aoi is not None:
+        area_sq_km = utils.approximate_area(*utils.aoi_bounds(aoi))
+        pixel_area = area_sq_km / (rows * cols)
+        stats['gain_area_sq_km'] = gain_pixels * pixel_area
+        stats['loss_area_sq_km'] = loss_pixels * pixel_area
+
+    return delta_display, stats
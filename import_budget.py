@@ -0,0 +1,139 @@
+"""
+Import-time budget check for TerraScan's own modules.
+
+Run from the repository root (exits non-zero when over budget):
+
+    python import_budget.py
+
+Each module is imported in a fresh interpreter. The check fails if the import
+takes longer than its budget or pulls in a heavy dependency that should only
+be loaded when its feature is first used (pandas at export, matplotlib and
+PIL at render, requests at fetch).
+
+A last probe imports everything app.py imports at the top level, which is
+what the first paint of the app pays for, and checks that every TerraScan
+module it loads has a budget of its own above.
+
+Set TERRASCAN_IMPORT_BUDGET_SCALE (e.g. 2) to loosen every budget on slower
+machines. Nothing runs this check automatically: there is no CI, so run it by
+hand before merging changes to imports.
+"""
+import ast
+import os
+import subprocess
+import sys
+
+# Seconds allowed for a cold import of each module (numpy and streamlit
+# included). Measured best times were about 0.07 s for the numpy modules and
+# 0.35-0.4 s for planet_handler (streamlit). The budgets leave only enough
+# headroom for run-to-run noise, so an eager matplotlib import already fails
+IMPORT_BUDGETS = {
+    'metrics': 0.01,
+    'profiling': 0.03,
+    'utils': 0.15,
+    'planet_handler': 0.6,
+    'analysis': 0.15,
+    'change_detection': 0.15,
+    'jobs': 0.03,
+    'local_provider': 0.15,
+    'monitor': 0.15,
+    'raster_cache': 0.15,
+    'rate_limiter': 0.01,
+    'scene_selection': 0.15,
+    'spatial_index': 0.01,
+    'spectral': 0.15,
+}
+
+# Seconds allowed for the app's top-level imports together (folium included);
+# measured at 0.95-1.55 s. That range overlaps the old eager set (1.3-1.6 s),
+# so a reverted lazy import is caught by APP_DEFERRED_MODULES, not by the time
+APP_IMPORT_BUDGET = 1.6
+
+# folium needs pandas and requests for the map on first paint, so only the
+# rendering libraries must stay deferred at the app level
+APP_DEFERRED_MODULES = ('matplotlib', 'PIL')
+
+# Modules that must not be loaded just by importing the app's own modules
+DEFERRED_MODULES = ('pandas', 'matplotlib', 'PIL', 'requests')
+
+_PROBE = """
+import sys, time
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+loaded = [name for name in {deferred!r} if name in sys.modules]
+own = sorted(name for name in sys.modules if name in {own!r})
+print(repr((elapsed, loaded, own)))
+"""
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def own_modules():
+    """
+    Returns the names of TerraScan's own top-level modules.
+    """
+    return [name[:-3] for name in os.listdir(_ROOT) if name.endswith(".py") and name not in ("app.py", "import_budget.py")]
+
+
+def app_imports(path=os.path.join(_ROOT, "app.py")):
+    """
+    Returns the import statements at the top level of app.py, as source.
+    """
+    with open(path) as f:
+        source = f.read()
+    tree = ast.parse(source)
+    return "\n".join(
+        ast.get_source_segment(source, node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))
+    )
+
+
+def measure_import(imports, repeats=5, deferred=DEFERRED_MODULES):
+    """
+    Runs import statements in fresh interpreters and returns the best time,
+    the deferred modules loaded and the TerraScan modules loaded.
+    """
+    best = None
+    loaded = own = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(imports=imports, deferred=deferred, own=own_modules())],
+            cwd=_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        elapsed, loaded, own = ast.literal_eval(output)
+        best = elapsed if best is None else min(best, elapsed)
+    return best, loaded, own
+
+
+def check_budgets(scale=1.0):
+    """
+    Returns a list of budget violations (empty when everything is in budget).
+
+    `scale` multiplies every budget, e.g. for slow CI machines.
+    """
+    failures = []
+    for module, budget in IMPORT_BUDGETS.items():
+        elapsed, loaded, _ = measure_import(f"import {module}")
+        print(f"{module:<16} {elapsed * 1000:8.1f} ms  (budget {budget * scale * 1000:.0f} ms)")
+        if elapsed > budget * scale:
+            failures.append(f"{module} took {elapsed:.3f}s, budget is {budget * scale:.3f}s")
+        if loaded:
+            failures.append(f"{module} eagerly imports {', '.join(loaded)}")
+
+    elapsed, loaded, own = measure_import(app_imports(), deferred=APP_DEFERRED_MODULES)
+    print(f"{'app (top level)':<16} {elapsed * 1000:8.1f} ms  (budget {APP_IMPORT_BUDGET * scale * 1000:.0f} ms)")
+    if elapsed > APP_IMPORT_BUDGET * scale:
+        failures.append(f"app imports took {elapsed:.3f}s, budget is {APP_IMPORT_BUDGET * scale:.3f}s")
+    if loaded:
+        failures.append(f"app eagerly imports {', '.join(loaded)}")
+    unbudgeted = [module for module in own if module not in IMPORT_BUDGETS]
+    if unbudgeted:
+        failures.append(f"app loads modules without an import budget: {', '.join(unbudgeted)}")
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check_budgets(float(os.environ.get("TERRASCAN_IMPORT_BUDGET_SCALE", "1.0")))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Heavy analyses allowed to run at once in this process
+MAX_WORKERS = int(os.environ.get("TERRASCAN_MAX_JOBS", "2"))
+
+# Jobs allowed to wait for a worker before new submissions are refused
+MAX_PENDING = int(os.environ.get("TERRASCAN_MAX_PENDING_JOBS", "8"))
+
+# Finished jobs (and their results) are dropped after this many seconds
+JOB_TTL_SECONDS = 600
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+_jobs = {}
+_lock = threading.Lock()
+_executor = None
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation has been requested."""
+
+
+class JobQueueFull(Exception):
+    """Raised by submit() when the process already has too many jobs queued."""
+
+
+class Job:
+    """
+    State of one background job, shared between the worker and the UI.
+
+    The worker reports through update() and calls check_cancelled() between
+    stages; the UI reads the attributes on every rerun.
+    """
+
+    def __init__(self, owner=None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.status = QUEUED
+        self.progress = 0
+        self.message = "Waiting for a free analysis worker..."
+        self.preview = None
+        self.result = None
+        self.error = None
+        self.error_level = None
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_event.is_set()
+
+    def update(self, progress=None, message=None, preview=None):
+        """
+        Publishes progress (0-100), a status message and/or a preview result.
+        """
+        if progress is not None:
+            self.progress = int(progress)
+        if message is not None:
+            self.message = message
+        if preview is not None:
+            self.preview = preview
+
+    def check_cancelled(self):
+        """
+        Stops the job at a safe point if cancellation was requested.
+        """
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="terrascan-job")
+    return _executor
+
+
+def _purge_expired(now):
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job.finished is not None and now - job.finished > JOB_TTL_SECONDS
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def _finish(job, status):
+    job.status = status
+    job.finished = time.time()
+
+
+def _run(job, fn, args, kwargs):
+    if job.cancel_requested:
+        _finish(job, CANCELLED)
+        return
+    job.status = RUNNING
+    job.message = "Starting analysis..."
+    try:
+        job.result = fn(job, *args, **kwargs)
+    except JobCancelled:
+        _finish(job, CANCELLED)
+    except Exception as e:
+        job.error = str(e)
+        # Exceptions with a display level (e.g. PlanetDataError) are user-facing
+        job.error_level = getattr(e, 'level', None)
+        _finish(job, FAILED)
+    else:
+        job.progress = 100
+        _finish(job, DONE)
+
+
+def submit(fn, *args, owner=None, **kwargs):
+    """
+    Queues fn(job, *args, **kwargs) on the worker pool and returns the job id.
+
+    Raises JobQueueFull when MAX_WORKERS + MAX_PENDING jobs are already active.
+    """
+    with _lock:
+        _purge_expired(time.time())
+        if active_count() >= MAX_WORKERS + MAX_PENDING:
+            raise JobQueueFull("Too many analyses are running. Please try again in a moment.")
+        job = Job(owner)
+        _jobs[job.id] = job
+    job.future = _get_executor().submit(_run, job, fn, args, kwargs)
+    return job.id
+
+
+def get(job_id, owner=None):
+    """
+    Returns the Job for an id, or None if it is unknown or has expired.
+
+    When `owner` is given, jobs submitted by a different owner are treated
+    as unknown.
+    """
+    with _lock:
+        _purge_expired(time.time())
+        job = _jobs.get(job_id)
+    if job is not None and owner is not None and job.owner != owner:
+        return None
+    return job
+
+
+def cancel(job_id, owner=None):
+    """
+    Requests cancellation. Queued jobs never start; running jobs stop at
+    their next check_cancelled() call. `owner` is checked as in get().
+    """
+    job = get(job_id, owner)
+    if job is None or job.status in FINISHED_STATES:
+        return
+    job._cancel_event.set()
+    if job.future is not None and job.future.cancel():
+        _finish(job, CANCELLED)
+
+
+def active_count():
+    """
+    Returns the number of queued or running jobs in this process.
+    """
+    return sum(1 for job in list(_jobs.values()) if job.status not in FINISHED_STATES)
@@ -0,0 +1,417 @@
+"""
+Concurrent-session load test for the TerraScan app.
+
+Run from the repository root:
+
+    python loadtest.py --sessions 8 --rounds 2
+
+Each simulated session drives app.py in this process, as the Streamlit
+server would, through the load -> draw -> analyze -> view -> download flow.
+Planet searches go to a local stand-in server (TERRASCAN_PLANET_API_URL), so
+no API key or network access is needed. The report lists throughput, p50 /
+p95 / p99 latency per step and the process's memory growth, which is what a
+container sizing estimate needs. One unmeasured session runs first so that
+imports and other one-off costs are not counted as per-session growth.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import warnings
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# Steps of one simulated user flow, in order
+STEPS = ("load", "draw", "analyze", "view", "download")
+
+# Size (degrees) of each session's AOI; sessions are spaced so that their
+# AOIs do not overlap unless --same-aoi is given
+AOI_SIZE_DEG = 0.1
+AOI_SPACING_DEG = 0.5
+
+# Origin of the simulated AOIs (near Nairobi)
+AOI_ORIGIN = (36.5, -1.5)
+
+# Interval between memory samples (seconds)
+MEMORY_SAMPLE_SECONDS = 0.2
+
+
+def _geometry_bounds(geometry):
+    coordinates = geometry['coordinates'][0]
+    lons = [point[0] for point in coordinates]
+    lats = [point[1] for point in coordinates]
+    return min(lons), max(lons), min(lats), max(lats)
+
+
+class StandInBackend:
+    """
+    Local HTTP server answering Planet quick searches with one clear scene
+    that covers the searched geometry.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.searches = 0
+        self._lock = threading.Lock()
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                body = json.dumps(backend.search(request)).encode("utf-8")
+                if backend.latency:
+                    time.sleep(backend.latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def search(self, request):
+        with self._lock:
+            self.searches += 1
+            scene_number = self.searches
+        filters = request.get('filter', {}).get('config', [])
+        geometry = next((f['config'] for f in filters if f.get('type') == 'GeometryFilter'), None)
+        if geometry is None:
+            return {'features': []}
+        min_lon, max_lon, min_lat, max_lat = _geometry_bounds(geometry)
+        pad = 0.05
+        footprint = [[
+            [min_lon - pad, min_lat - pad], [max_lon + pad, min_lat - pad], [max_lon + pad, max_lat + pad],
+            [min_lon - pad, max_lat + pad], [min_lon - pad, min_lat - pad],
+        ]]
+        acquired = datetime.now(timezone.utc) - timedelta(days=1)
+        return {'features': [{
+            'id': f"loadtest_{scene_number}",
+            'geometry': {'type': 'Polygon', 'coordinates': footprint},
+            'properties': {
+                'acquired': acquired.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                'cloud_cover': 0.02,
+                'sun_elevation': 50,
+            },
+        }]}
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def resident_memory_mb():
+    """
+    Returns this process's resident set size in MB, or None off Linux.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class MemorySampler:
+    """Samples resident memory in the background and keeps the peak."""
+
+    def __init__(self, interval=MEMORY_SAMPLE_SECONDS):
+        self.interval = interval
+        self.start_mb = resident_memory_mb()
+        self.peak_mb = self.start_mb
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            current = resident_memory_mb()
+            if current is not None and (self.peak_mb is None or current > self.peak_mb):
+                self.peak_mb = current
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        end_mb = resident_memory_mb()
+        if end_mb is not None and (self.peak_mb is None or end_mb > self.peak_mb):
+            self.peak_mb = end_mb
+        return end_mb
+
+
+def session_aoi(index, same_aoi=False):
+    """
+    Returns the GeoJSON polygon simulated session `index` draws.
+    """
+    offset = 0 if same_aoi else index
+    min_lon = AOI_ORIGIN[0] + (offset % 10) * AOI_SPACING_DEG
+    min_lat = AOI_ORIGIN[1] + (offset // 10) * AOI_SPACING_DEG
+    max_lon, max_lat = min_lon + AOI_SIZE_DEG, min_lat + AOI_SIZE_DEG
+    return {
+        'type': 'Polygon',
+        'coordinates': [[
+            [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat],
+            [min_lon, max_lat], [min_lon, min_lat]
+        ]]
+    }
+
+
+def share_test_runtime(api_key):
+    """
+    Lets several AppTest sessions run at the same time in this process.
+
+    AppTest installs a mock Runtime and the app's secrets for each run and
+    clears both when the run ends, which breaks every other session still
+    running. The secrets are installed once for the whole process instead and
+    the Runtime reset at the end of a run is ignored.
+    """
+    import streamlit as st
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test
+
+    class KeepInstance(type(Runtime)):
+        def __setattr__(cls, name, value):
+            if name == "_instance":
+                if value is not None:
+                    Runtime._instance = value
+                return
+            super().__setattr__(name, value)
+
+    app_test.Runtime = KeepInstance("SharedRuntime", (Runtime,), {})
+    secrets = Secrets()
+    secrets._secrets = {"PLANET_API_KEY": api_key}
+    st.secrets = secrets
+
+
+class LoadTest:
+    """
+    Runs simulated sessions concurrently and collects per-step latencies.
+    """
+
+    def __init__(self, sessions, rounds=1, ramp_seconds=0.0, timeout=300, same_aoi=False):
+        self.sessions = sessions
+        self.rounds = rounds
+        self.ramp_seconds = ramp_seconds
+        self.timeout = timeout
+        self.same_aoi = same_aoi
+        self.latencies = {step: [] for step in STEPS}
+        self.completed_flows = 0
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def _timed(self, step, action):
+        started = time.perf_counter()
+        result = action()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[step].append(elapsed)
+        return result
+
+    def _check(self, at, step):
+        problems = [str(exception.value) for exception in at.exception] + [str(error.value) for error in at.error]
+        if problems:
+            raise RuntimeError(f"{step}: {problems[0].strip()}")
+
+    def _analyze(self, at, button):
+        # In a browser the status fragment polls by itself; here the job is
+        # awaited directly and one full rerun then picks up the result
+        import jobs
+
+        button.click().run()
+        job_id = at.session_state["active_job_id"]
+        while job_id:
+            job = jobs.get(job_id)
+            if job is None or job.status in jobs.FINISHED_STATES:
+                break
+            time.sleep(0.1)
+        at.run()
+
+    def run_session(self, index):
+        from streamlit.testing.v1 import AppTest
+
+        at = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+        aoi = session_aoi(index, self.same_aoi)
+        try:
+            self._timed("load", at.run)
+            self._check(at, "load")
+            for _ in range(self.rounds):
+                at.session_state["aoi"] = aoi
+                self._timed("draw", at.run)
+                self._check(at, "draw")
+
+                analyze = next(button for button in at.button if "Start Satellite Analysis" in button.label)
+                self._timed("analyze", lambda: self._analyze(at, analyze))
+                self._check(at, "analyze")
+                if at.session_state["analysis_results"] is None:
+                    shown = [str(element.value).strip() for element in list(at.warning) + list(at.info)]
+                    raise RuntimeError(f"analyze: no results ({shown[0] if shown else 'nothing shown'})")
+
+                self._timed("view", at.run)
+                self._check(at, "view")
+
+                download = next(button for button in at.get("download_button") if "Report" in button.label)
+                self._timed("download", download.click().run)
+                self._check(at, "download")
+                if not at.session_state["analysis_results"].get("report_csv"):
+                    raise RuntimeError("download: report is empty")
+
+                with self._lock:
+                    self.completed_flows += 1
+        except Exception as e:
+            with self._lock:
+                self.failures.append(f"session {index}: {type(e).__name__}: {e}")
+
+    def run(self):
+        threads = []
+        started = time.perf_counter()
+        for index in range(self.sessions):
+            thread = threading.Thread(target=self.run_session, args=(index,), daemon=True)
+            thread.start()
+            threads.append(thread)
+            if self.ramp_seconds and index < self.sessions - 1:
+                time.sleep(self.ramp_seconds / self.sessions)
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def warm_up(backend, timeout=300):
+    """
+    Runs one unmeasured session so the app's modules are imported and its
+    one-off allocations made before the memory baseline is taken.
+
+    The raster cache and backend search count are reset afterwards so the
+    measured sessions start from the same state as a fresh server.
+    """
+    import raster_cache
+
+    test = LoadTest(1, timeout=timeout)
+    test.run_session(0)
+    if test.failures:
+        raise RuntimeError(f"warm-up failed: {test.failures[0]}")
+    raster_cache.invalidate(0)
+    backend.searches = 0
+
+
+def summarize(test, wall_time, memory_start, memory_end, memory_peak, searches):
+    """
+    Builds the JSON-serializable load-test report.
+    """
+    steps = {}
+    for step, samples in test.latencies.items():
+        if samples:
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            steps[step] = {
+                'count': len(samples),
+                'p50': float(p50), 'p95': float(p95), 'p99': float(p99),
+                'max': float(max(samples)),
+            }
+    report = {
+        'sessions': test.sessions,
+        'rounds': test.rounds,
+        'wall_time_seconds': wall_time,
+        'completed_flows': test.completed_flows,
+        'failed_sessions': len(test.failures),
+        'failures': test.failures,
+        'throughput_flows_per_minute': test.completed_flows / wall_time * 60 if wall_time else 0.0,
+        'steps': steps,
+        'backend_searches': searches,
+        'memory_mb': None,
+    }
+    if memory_start is not None:
+        report['memory_mb'] = {
+            'start': memory_start,
+            'end': memory_end,
+            'peak': memory_peak,
+            'growth': memory_end - memory_start,
+            'peak_growth_per_session': (memory_peak - memory_start) / test.sessions,
+        }
+    return report
+
+
+def print_report(report, memory_limit_mb=None):
+    print(f"Sessions: {report['sessions']}  Rounds: {report['rounds']}  "
+          f"Wall time: {report['wall_time_seconds']:.1f} s")
+    print(f"Completed flows: {report['completed_flows']}  Failed sessions: {report['failed_sessions']}  "
+          f"Throughput: {report['throughput_flows_per_minute']:.1f} flows/min")
+    print()
+    print(f"{'step':<10} {'count':>6} {'p50 (s)':>9} {'p95 (s)':>9} {'p99 (s)':>9} {'max (s)':>9}")
+    for step in STEPS:
+        stats = report['steps'].get(step)
+        if stats:
+            print(f"{step:<10} {stats['count']:>6} {stats['p50']:>9.3f} {stats['p95']:>9.3f} "
+                  f"{stats['p99']:>9.3f} {stats['max']:>9.3f}")
+    print()
+
+    memory = report['memory_mb']
+    if memory is None:
+        print("Memory: not available on this platform")
+    else:
+        print(f"Memory (RSS, after warm-up): start {memory['start']:.0f} MB, end {memory['end']:.0f} MB, "
+              f"peak {memory['peak']:.0f} MB, peak growth {memory['peak_growth_per_session']:.1f} MB/session")
+        if memory_limit_mb and memory['peak_growth_per_session'] > 0:
+            fits = (memory_limit_mb - memory['start']) / memory['peak_growth_per_session']
+            print(f"Estimated concurrent sessions within {memory_limit_mb:.0f} MB: {max(int(fits), 0)}")
+    print(f"Stand-in backend searches: {report['backend_searches']}")
+
+    for failure in report['failures']:
+        print(f"FAILED {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the TerraScan app with concurrent simulated sessions.")
+    parser.add_argument("--sessions", type=int, default=4, help="number of concurrent simulated users")
+    parser.add_argument("--rounds", type=int, default=1, help="analyses each session runs")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds over which sessions are started")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds allowed for one app run")
+    parser.add_argument("--backend-latency", type=float, default=0.0, help="seconds the stand-in search waits")
+    parser.add_argument("--same-aoi", action="store_true", help="every session draws the same area")
+    parser.add_argument("--memory-limit-mb", type=float, help="container memory to estimate capacity against")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    backend = StandInBackend(args.backend_latency).start()
+    # Must be set before the app's modules are first imported
+    os.environ["TERRASCAN_PLANET_API_URL"] = backend.url
+    os.environ.setdefault("TERRASCAN_METRICS_PORT", "0")
+    warnings.filterwarnings("ignore")
+
+    import streamlit.logger
+    streamlit.logger.set_log_level("error")
+    share_test_runtime("loadtest")
+
+    warm_up(backend, args.timeout)
+    test = LoadTest(args.sessions, args.rounds, args.ramp, args.timeout, args.same_aoi)
+    sampler = MemorySampler().start()
+    try:
+        wall_time = test.run()
+    finally:
+        memory_end = sampler.stop()
+        backend.stop()
+
+    report = summarize(test, wall_time, sampler.start_mb, memory_end, sampler.peak_mb, backend.searches)
+    print_report(report, args.memory_limit_mb)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if test.failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,253 @@
+import math
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+import metrics
+import spectral
+import utils
+
+# Band order of a local stack, by the name shown in the app
+BAND_ORDERS = {
+    'PlanetScope 4-band (Blue, Green, Red, NIR)': ('blue', 'green', 'red', 'nir'),
+    'Red, Green, Blue, NIR': ('red', 'green', 'blue', 'nir'),
+}
+DEFAULT_BAND_ORDER = BAND_ORDERS['PlanetScope 4-band (Blue, Green, Red, NIR)']
+
+# File types the local provider reads (GeoTIFF needs the optional rasterio,
+# see requirements-geotiff.txt)
+NUMPY_SUFFIXES = ('.npy',)
+GEOTIFF_SUFFIXES = ('.tif', '.tiff')
+
+# Directory local rasters are read from; the local source is disabled unless set
+LOCAL_DATA_DIR = os.environ.get("TERRASCAN_LOCAL_DATA_DIR")
+
+# Percentiles mapped to black and white in the true-colour preview
+RGB_STRETCH_PERCENTILES = (2, 98)
+
+
+class LocalDataError(Exception):
+    """
+    A local raster failure with a message ready to show to the user.
+
+    `level` is 'error' or 'warning' and selects how the app displays it.
+    """
+
+    def __init__(self, message, level='error'):
+        super().__init__(message)
+        self.level = level
+
+
+class _RasterioBand:
+    """
+    Array-like view of one GeoTIFF band; slicing reads only that window.
+
+    Strided slices read full-resolution strips of at most CHUNK_ROWS rows and
+    keep every step-th pixel, so they return exactly the pixels the same
+    slice of a NumPy array would (GDAL's decimated reads resample instead).
+    """
+
+    def __init__(self, dataset, index):
+        self.dataset = dataset
+        self.index = index
+        self.shape = (dataset.height, dataset.width)
+
+    def __getitem__(self, key):
+        from rasterio.windows import Window
+
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        row_start, row_stop, row_step = rows.indices(self.shape[0])
+        col_start, col_stop, col_step = cols.indices(self.shape[1])
+        width = max(col_stop - col_start, 0)
+        # Strips start on the row grid, so slicing each one keeps the alignment
+        strip_rows = max(spectral.CHUNK_ROWS // row_step, 1) * row_step
+        strips = [
+            self.dataset.read(
+                self.index, window=Window(col_start, start, width, min(start + strip_rows, row_stop) - start)
+            )[::row_step, ::col_step]
+            for start in range(row_start, row_stop, strip_rows)
+        ]
+        if not strips:
+            return np.empty((0, len(range(col_start, col_stop, col_step))), dtype=self.dataset.dtypes[self.index - 1])
+        return np.concatenate(strips) if len(strips) > 1 else strips[0]
+
+
+def resolve_path(path):
+    """
+    Returns the absolute path of a local raster inside LOCAL_DATA_DIR.
+
+    Paths are taken relative to LOCAL_DATA_DIR. Missing files and paths that
+    escape the directory get the same message, and neither echoes the path,
+    so the error cannot be used to probe the server's filesystem.
+    """
+    if not LOCAL_DATA_DIR:
+        raise LocalDataError("🚫 Local raster files are not enabled on this server")
+    if not path or not path.strip():
+        raise LocalDataError("❌ Please enter the path of a local raster file")
+    suffix = os.path.splitext(path.strip())[1].lower()
+    if suffix not in NUMPY_SUFFIXES + GEOTIFF_SUFFIXES:
+        supported = ', '.join(NUMPY_SUFFIXES + GEOTIFF_SUFFIXES)
+        raise LocalDataError(f"❌ Unsupported file type. Supported: {supported}")
+    root = os.path.realpath(LOCAL_DATA_DIR)
+    resolved = os.path.realpath(os.path.join(root, path.strip()))
+    if os.path.commonpath([root, resolved]) != root or not os.path.isfile(resolved):
+        raise LocalDataError("❌ No readable raster at that path in the local data directory")
+    return resolved
+
+
+def _numpy_bands(path, band_order):
+    # Memory-mapped, so opening costs nothing and pages load as windows are read
+    stack = np.load(path, mmap_mode='r')
+    if stack.ndim != 3:
+        raise LocalDataError(f"❌ Expected a 3D band stack, got an array of shape {stack.shape}")
+    if stack.shape[0] == len(band_order):
+        return {name: stack[i] for i, name in enumerate(band_order)}
+    if stack.shape[-1] == len(band_order):
+        return {name: stack[..., i] for i, name in enumerate(band_order)}
+    raise LocalDataError(
+        f"❌ The stack has shape {stack.shape} but {len(band_order)} bands ({', '.join(band_order)}) were expected"
+    )
+
+
+@contextmanager
+def open_local_raster(path, band_order=DEFAULT_BAND_ORDER):
+    """
+    Opens a local band stack without reading its pixels.
+
+    Yields (bands, info): bands maps band names to 2D array-likes that read
+    only the window they are sliced with, and info holds the 'shape', the
+    file's 'nodata' value and its lon/lat 'bounds' (None when the file is
+    not georeferenced, as for NumPy stacks).
+    """
+    path = resolve_path(path)
+    suffix = os.path.splitext(path)[1].lower()
+
+    if suffix in NUMPY_SUFFIXES:
+        bands = _numpy_bands(path, band_order)
+        yield bands, {'shape': bands[band_order[0]].shape, 'nodata': None, 'bounds': None}
+
+    else:
+        try:
+            import rasterio
+            from rasterio.warp import transform_bounds
+        except ImportError:
+            raise LocalDataError("❌ Reading GeoTIFF files requires rasterio (pip install -r requirements-geotiff.txt)")
+
+        with rasterio.open(path) as dataset:
+            if dataset.count < len(band_order):
+                raise LocalDataError(
+                    f"❌ The file has {dataset.count} band(s) but {len(band_order)} ({', '.join(band_order)}) were expected"
+                )
+            bounds = None
+            if dataset.crs is not None:
+                left, bottom, right, top = transform_bounds(dataset.crs, 'EPSG:4326', *dataset.bounds)
+                bounds = (left, right, bottom, top)
+            bands = {name: _RasterioBand(dataset, i + 1) for i, name in enumerate(band_order)}
+            yield bands, {'shape': (dataset.height, dataset.width), 'nodata': dataset.nodata, 'bounds': bounds}
+
+
+def preview_step(shape, max_pixels=utils.MAX_WORKING_PIXELS):
+    """
+    Returns the decimation step that brings a raster within `max_pixels`.
+    """
+    rows, cols = shape
+    return max(1, math.ceil(math.sqrt(rows * cols / max_pixels)))
+
+
+def _stretch_to_uint8(band):
+    valid = band[np.isfinite(band)]
+    if not valid.size:
+        return np.zeros(band.shape, dtype=np.uint8)
+    low, high = np.percentile(valid, RGB_STRETCH_PERCENTILES)
+    scaled = (band - low) / ((high - low) or 1.0) * 255
+    return np.nan_to_num(np.clip(scaled, 0, 255)).astype(np.uint8)
+
+
+def _rgb_preview(bands, step, nodata):
+    channels = []
+    for name in ('red', 'green', 'blue'):
+        band = np.asarray(bands[name][::step, ::step], dtype=np.float32)
+        if nodata is not None:
+            band[band == nodata] = np.nan
+        channels.append(_stretch_to_uint8(band))
+    return np.dstack(channels)
+
+
+def analyze_local_raster(path, threshold=0.2, band_order=DEFAULT_BAND_ORDER, aoi=None, nodata=None,
+                         chunk_rows=spectral.CHUNK_ROWS, progress=None):
+    """
+    Classifies a local band stack window by window, never loading it whole.
+
+    NDVI is computed by spectral.iter_index_chunks one block of rows at a
+    time and the healthy / degraded pixel counts are accumulated, so the
+    degradation percentage is exact at full resolution while memory stays
+    flat. Only decimated previews (at most MAX_WORKING_PIXELS) are kept for
+    display. Files that are not georeferenced are assumed to cover `aoi`.
+    `progress`, if given, is called with the fraction of rows done and may
+    raise to stop the pass. Returns a summary dict.
+    """
+    with open_local_raster(path, band_order) as (bands, info):
+        bounds = info['bounds']
+        if bounds is None:
+            if not aoi:
+                raise LocalDataError(
+                    "⚠️ This file has no location. Draw the area it covers on the map first.", level='warning'
+                )
+            bounds = utils.aoi_bounds(aoi)
+        nodata = info['nodata'] if nodata is None else nodata
+
+        rows, cols = info['shape']
+        step = preview_step((rows, cols))
+        ndvi_preview = np.empty((math.ceil(rows / step), math.ceil(cols / step)), dtype=np.float32)
+        degraded_pixels = 0
+        healthy_pixels = 0
+
+        with metrics.span("local_raster_ndvi"):
+            for row_start, chunks in spectral.iter_index_chunks(bands, ('ndvi',), chunk_rows, nodata=nodata):
+                ndvi = chunks['ndvi']
+                degraded_pixels += int(np.count_nonzero(ndvi < threshold))
+                healthy_pixels += int(np.count_nonzero(ndvi >= threshold))
+
+                # Keep the rows and columns that fall on the preview grid
+                first = (-row_start) % step
+                kept = ndvi[first::step, ::step]
+                preview_row = (row_start + first) // step
+                ndvi_preview[preview_row:preview_row + kept.shape[0]] = kept
+
+                if progress is not None:
+                    progress((row_start + ndvi.shape[0]) / rows)
+
+        with metrics.span("local_raster_preview"):
+            rgb_preview = _rgb_preview(bands, step, nodata)
+
+    metrics.add_bytes("local_raster_pixels", rows * cols)
+    total_pixels = degraded_pixels + healthy_pixels
+    return {
+        'path': path,
+        'shape': (rows, cols),
+        'bounds': bounds,
+        'georeferenced': info['bounds'] is not None,
+        'valid_pixels': total_pixels,
+        'degradation_percent': degraded_pixels / total_pixels * 100 if total_pixels else 0.0,
+        'preview_step': step,
+        'ndvi_preview': ndvi_preview,
+        'rgb_preview': rgb_preview,
+    }
+
+
+def describe_local_raster(summary):
+    """
+    Builds the user-facing summary of an analyzed local raster.
+    """
+    rows, cols = summary['shape']
+    text = f"""
+    ✅ **Local Raster Analyzed!**
+
+    **File:** {os.path.basename(summary['path'])}
+    **Size:** {cols:,} x {rows:,} pixels ({summary['valid_pixels']:,} valid)
+    **Location:** {'From the file' if summary['georeferenced'] else 'Drawn area'}"""
+    if summary['preview_step'] > 1:
+        text += f"""
+    **Preview:** 1/{summary['preview_step']} resolution (statistics use every pixel)"""
+    return text + "\n    "
@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Histogram buckets (seconds) for per-stage latency, suitable for histogram_quantile()
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Number of recent samples kept per stage for the diagnostics panel
+RECENT_SAMPLES = 500
+
+_lock = threading.Lock()
+_durations = {}
+_recent = defaultdict(lambda: deque(maxlen=RECENT_SAMPLES))
+_bytes = defaultdict(int)
+_cache = defaultdict(lambda: {'hit': 0, 'miss': 0})
+_events = defaultdict(int)
+_gauges = {}
+_server = None
+
+
+class _Histogram:
+    """Cumulative Prometheus-style histogram for a single stage."""
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+
+def observe(stage, seconds):
+    """
+    Records one duration sample (in seconds) for a pipeline stage.
+    """
+    with _lock:
+        histogram = _durations.get(stage)
+        if histogram is None:
+            histogram = _durations[stage] = _Histogram()
+        histogram.observe(seconds)
+        _recent[stage].append(seconds)
+
+
+@contextmanager
+def span(stage):
+    """
+    Times the enclosed block and records it under the given stage name.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def add_bytes(kind, count):
+    """
+    Increments the byte counter for a transfer or payload kind.
+    """
+    with _lock:
+        _bytes[kind] += int(count)
+
+
+def record_cache(cache, hit):
+    """
+    Records a hit or a miss for a named cache.
+    """
+    with _lock:
+        _cache[cache]['hit' if hit else 'miss'] += 1
+
+
+def increment(event, amount=1):
+    """
+    Increments the counter for a named event (e.g. an API response status).
+    """
+    with _lock:
+        _events[event] += amount
+
+
+def set_gauge(name, value):
+    """
+    Sets a gauge to its current value (e.g. quota used, queue length).
+    """
+    with _lock:
+        _gauges[name] = float(value)
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def snapshot():
+    """
+    Returns a plain-dict summary of all metrics for display in the app.
+    """
+    with _lock:
+        stages = {}
+        for stage, histogram in _durations.items():
+            recent = list(_recent[stage])
+            stages[stage] = {
+                'count': histogram.count,
+                'mean': histogram.total / histogram.count if histogram.count else 0.0,
+                'p50': _percentile(recent, 0.50) if recent else 0.0,
+                'p95': _percentile(recent, 0.95) if recent else 0.0,
+            }
+        caches = {}
+        for cache, counts in _cache.items():
+            lookups = counts['hit'] + counts['miss']
+            caches[cache] = {
+                'hits': counts['hit'],
+                'misses': counts['miss'],
+                'hit_ratio': counts['hit'] / lookups if lookups else 0.0,
+            }
+        return {
+            'stages': stages,
+            'bytes': dict(_bytes),
+            'caches': caches,
+            'events': dict(_events),
+            'gauges': dict(_gauges),
+        }
+
+
+def render_prometheus():
+    """
+    Renders all metrics in the Prometheus text exposition format.
+    """
+    lines = [
+        "# HELP terrascan_stage_duration_seconds Time spent in each analysis stage.",
+        "# TYPE terrascan_stage_duration_seconds histogram",
+    ]
+    with _lock:
+        for stage, histogram in sorted(_durations.items()):
+            for bound, count in zip(DURATION_BUCKETS, histogram.bucket_counts):
+                lines.append(f'terrascan_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'terrascan_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'terrascan_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.total:.6f}')
+            lines.append(f'terrascan_stage_duration_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        lines.append("# HELP terrascan_bytes_total Bytes transferred or produced, by kind.")
+        lines.append("# TYPE terrascan_bytes_total counter")
+        for kind, count in sorted(_bytes.items()):
+            lines.append(f'terrascan_bytes_total{{kind="{kind}"}} {count}')
+
+        lines.append("# HELP terrascan_cache_requests_total Cache lookups, by cache and result.")
+        lines.append("# TYPE terrascan_cache_requests_total counter")
+        for cache, counts in sorted(_cache.items()):
+            for result in ('hit', 'miss'):
+                lines.append(f'terrascan_cache_requests_total{{cache="{cache}",result="{result}"}} {counts[result]}')
+
+        lines.append("# HELP terrascan_cache_hit_ratio Fraction of cache lookups that were hits.")
+        lines.append("# TYPE terrascan_cache_hit_ratio gauge")
+        for cache, counts in sorted(_cache.items()):
+            lookups = counts['hit'] + counts['miss']
+            ratio = counts['hit'] / lookups if lookups else 0.0
+            lines.append(f'terrascan_cache_hit_ratio{{cache="{cache}"}} {ratio:.6f}')
+
+        lines.append("# HELP terrascan_events_total Occurrences of named events.")
+        lines.append("# TYPE terrascan_events_total counter")
+        for event, count in sorted(_events.items()):
+            lines.append(f'terrascan_events_total{{event="{event}"}} {count}')
+
+        lines.append("# HELP terrascan_gauge Current value of named gauges.")
+        lines.append("# TYPE terrascan_gauge gauge")
+        for name, value in sorted(_gauges.items()):
+            lines.append(f'terrascan_gauge{{name="{name}"}} {value:.6f}')
+
+    return "\n".join(lines) + "\n"
+
+
+def start_http_server(port=None, host="127.0.0.1"):
+    """
+    Serves /metrics on a local port from a daemon thread, once per process.
+
+    The port defaults to the TERRASCAN_METRICS_PORT environment variable
+    (9108 when unset); a port of 0 disables the endpoint. Returns the port
+    actually in use, or None if the endpoint is disabled or unavailable.
+    """
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    if port is None:
+        port = int(os.environ.get("TERRASCAN_METRICS_PORT", "9108"))
+    if not port:
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _lock:
+        if _server is not None:
+            return _server.server_address[1]
+        try:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError:
+            # Another process (or app instance) already owns the port
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="terrascan-metrics", daemon=True).start()
+        return _server.server_address[1]
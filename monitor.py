@@ -0,0 +1,317 @@
+"""
+Scheduled re-analysis of saved parcels, sharing scene downloads between them.
+
+Run as a daemon with a GeoJSON FeatureCollection of parcels (each feature may
+carry 'id' and 'threshold' properties) and PLANET_API_KEY in the environment:
+
+    python monitor.py parcels.geojson --interval 21600 --output results.jsonl
+
+Parcels are kept in a grid index. On every tick, parcels whose cells touch
+are searched together, and each newly acquired scene is picked once for all
+the parcels it covers. Only the parcels are clipped from it, with nearby
+parcels sharing one clip, so the quota is charged on the clipped area and the
+grid keeps the native pixel size. A parcel is only re-analyzed when a scene
+newer than its last analysis covers it.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import metrics
+import scene_selection
+import spatial_index
+import utils
+
+# Default time between monitoring passes (seconds)
+DEFAULT_INTERVAL_SECONDS = 6 * 3600
+
+# A scene must cover at least this fraction of a parcel to re-analyze it
+MIN_SCENE_COVERAGE = 0.95
+
+# Parcels share one clip of a scene only while the clip's box is at most this
+# many times the area of their own boxes
+MAX_CLIP_OVERHEAD = 1.25
+
+# Session id under which the daemon's Planet calls are rate limited
+MONITOR_SESSION = "monitor"
+
+logger = logging.getLogger("terrascan.monitor")
+
+
+class MonitoredAOI:
+    """A saved parcel and the acquisition date of its last analysis."""
+
+    def __init__(self, aoi_id, geometry, threshold=0.2, last_acquired=None):
+        self.id = aoi_id
+        self.geometry = geometry
+        self.bounds = utils.aoi_bounds(geometry)
+        self.threshold = threshold
+        self.last_acquired = last_acquired
+
+
+def _union_bounds(aois):
+    return (
+        min(aoi.bounds[0] for aoi in aois), max(aoi.bounds[1] for aoi in aois),
+        min(aoi.bounds[2] for aoi in aois), max(aoi.bounds[3] for aoi in aois),
+    )
+
+
+def _area(bounds):
+    return utils.approximate_area(*bounds)
+
+
+def _native_pixels(bounds):
+    return _area(bounds) / utils.PIXEL_SIZE_KM ** 2
+
+
+def _clip_groups(aois):
+    """
+    Splits the parcels one scene serves into groups downloaded as one clip.
+
+    Groups are merged greedily, closest fit first, while the merged box stays
+    within MAX_CLIP_OVERHEAD of the parcels' own area and small enough to keep
+    the native pixel size, so sharing never costs extra quota or resolution.
+    Returns a list of (bounds, parcels) pairs.
+    """
+    groups = [(aoi.bounds, [aoi], _area(aoi.bounds)) for aoi in aois]
+    while len(groups) > 1:
+        best = None
+        for i in range(len(groups)):
+            for j in range(i + 1, len(groups)):
+                merged = _union_bounds(groups[i][1] + groups[j][1])
+                parcel_area = groups[i][2] + groups[j][2]
+                overhead = _area(merged) / (parcel_area or 1e-12)
+                if overhead > MAX_CLIP_OVERHEAD or _native_pixels(merged) > utils.MAX_WORKING_PIXELS:
+                    continue
+                if best is None or overhead < best[0]:
+                    best = (overhead, i, j, merged, parcel_area)
+        if best is None:
+            break
+        _, i, j, merged, parcel_area = best
+        members = groups[i][1] + groups[j][1]
+        groups = [group for k, group in enumerate(groups) if k not in (i, j)]
+        groups.append((merged, members, parcel_area))
+    return [(bounds, members) for bounds, members, _ in groups]
+
+
+def _acquired(item):
+    return scene_selection.parse_acquired(item.get('properties', {}).get('acquired'))
+
+
+class Monitor:
+    """
+    Re-checks monitored AOIs, using each qualifying scene once for all of them.
+
+    `on_result` is called with one dict per re-analyzed AOI.
+    """
+
+    def __init__(self, api_key, on_result=None, cell_deg=spatial_index.GRID_CELL_DEG, min_coverage=MIN_SCENE_COVERAGE):
+        self.api_key = api_key
+        self.on_result = on_result
+        self.min_coverage = min_coverage
+        self.index = spatial_index.GridIndex(cell_deg)
+        self.aois = {}
+        self._lock = threading.Lock()
+
+    def add(self, aoi_id, geometry, threshold=0.2, last_acquired=None):
+        with self._lock:
+            if aoi_id in self.aois:
+                self._remove(aoi_id)
+            aoi = MonitoredAOI(aoi_id, geometry, threshold, last_acquired)
+            self.aois[aoi_id] = aoi
+            self.index.insert(aoi_id, aoi.bounds)
+
+    def remove(self, aoi_id):
+        with self._lock:
+            self._remove(aoi_id)
+
+    def _remove(self, aoi_id):
+        aoi = self.aois.pop(aoi_id, None)
+        if aoi is not None:
+            self.index.remove(aoi_id, aoi.bounds)
+
+    def _assign_scenes(self, searched):
+        """
+        Maps scene ids to the AOIs each scene should serve.
+
+        `searched` is a list of (aoi, items found for it). Only scenes newer
+        than an AOI's last analysis that cover at least `min_coverage` of it
+        qualify.
+        """
+        qualifying = {}
+        acquired = {}
+        for aoi, items in searched:
+            candidates = []
+            for item in items:
+                acquired[item['id']] = _acquired(item) or datetime.min.replace(tzinfo=timezone.utc)
+                if aoi.last_acquired is None or acquired[item['id']] > aoi.last_acquired:
+                    candidates.append(item)
+            if candidates:
+                coverage = scene_selection.coverage_matrix(aoi.geometry, candidates).mean(axis=1)
+                qualifying[aoi.id] = {
+                    item['id'] for item, fraction in zip(candidates, coverage) if fraction >= self.min_coverage
+                }
+
+        # Greedily pick the scene serving the most unassigned AOIs (newest first
+        # on ties) so that as few scenes as possible are downloaded
+        pending = {aoi.id: aoi for aoi, _ in searched if qualifying.get(aoi.id)}
+        assignments = {}
+        while pending:
+            served = defaultdict(list)
+            for aoi_id, aoi in pending.items():
+                for scene_id in qualifying[aoi_id]:
+                    served[scene_id].append(aoi)
+            scene_id = max(served, key=lambda sid: (len(served[sid]), acquired[sid]))
+            assignments[scene_id] = served[scene_id]
+            for aoi in served[scene_id]:
+                del pending[aoi.id]
+        return assignments
+
+    def run_once(self, now=None):
+        """
+        Runs one monitoring pass and returns the results produced.
+        """
+        import planet_handler
+
+        now = now or datetime.now(timezone.utc)
+        with self._lock:
+            groups = [[self.aois[key] for key in keys] for keys in self.index.clusters()]
+
+        # One search per cluster of neighbouring AOIs
+        searched = []
+        items_by_id = {}
+        for group in groups:
+            bounds = _union_bounds(group)
+            known = [aoi.last_acquired for aoi in group if aoi.last_acquired is not None]
+            start = min(known) if len(known) == len(group) else now - timedelta(days=planet_handler.SEARCH_WINDOW_DAYS)
+            try:
+                with metrics.span("monitor_search"):
+                    items = planet_handler.search_scenes(
+                        utils.bounds_polygon(*bounds), self.api_key,
+                        start_date=start.astimezone(timezone.utc).replace(tzinfo=None), session_id=MONITOR_SESSION
+                    )
+            except Exception as e:
+                logger.warning("Search failed for %d parcel(s): %s", len(group), e)
+                continue
+            items_by_id.update((item['id'], item) for item in items)
+            searched.extend((aoi, items) for aoi in group)
+
+        # Each scene is picked once for the parcels it serves, even when they
+        # came from different clusters, and only their clips are downloaded
+        results = []
+        for scene_id, scene_aois in self._assign_scenes(searched).items():
+            item = items_by_id[scene_id]
+            metrics.increment("monitor_scene_downloads")
+            for clip_bounds, clip_aois in _clip_groups(scene_aois):
+                try:
+                    _, ndvi = planet_handler.download_scenes(
+                        [item], utils.bounds_polygon(*clip_bounds), MONITOR_SESSION
+                    )
+                except Exception as e:
+                    logger.warning("Download of %s for %d parcel(s) failed: %s", scene_id, len(clip_aois), e)
+                    continue
+                metrics.increment("monitor_clip_downloads")
+                metrics.increment("monitor_parcels_served", len(clip_aois))
+
+                for aoi in clip_aois:
+                    parcel_ndvi = utils.crop_to_bounds(ndvi, clip_bounds, aoi.bounds)
+                    degradation_percent, _ = utils.classify_ndvi(parcel_ndvi, aoi.threshold)
+                    aoi.last_acquired = _acquired(item) or now
+                    result = {
+                        'aoi_id': aoi.id,
+                        'scene_id': scene_id,
+                        'acquired': item.get('properties', {}).get('acquired'),
+                        'degradation_percent': round(float(degradation_percent), 2),
+                        'threshold': aoi.threshold,
+                        'analyzed_at': now.isoformat(),
+                    }
+                    results.append(result)
+                    if self.on_result is not None:
+                        self.on_result(result)
+        return results
+
+    def run_forever(self, interval=DEFAULT_INTERVAL_SECONDS, stop_event=None):
+        """
+        Runs monitoring passes every `interval` seconds until `stop_event` is set.
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            started = time.monotonic()
+            try:
+                results = self.run_once()
+                logger.info("Monitoring pass re-analyzed %d parcel(s)", len(results))
+            except Exception:
+                logger.exception("Monitoring pass failed")
+            stop_event.wait(max(interval - (time.monotonic() - started), 0))
+
+
+def load_parcels(monitor, path, state=None):
+    """
+    Adds every feature of a GeoJSON FeatureCollection to the monitor.
+
+    Polygon and MultiPolygon parcels are supported; other features are
+    skipped with a warning.
+
+    `state` maps AOI ids to the ISO acquisition date of their last analysis.
+    """
+    with open(path) as f:
+        collection = json.load(f)
+    state = state or {}
+    for i, feature in enumerate(collection.get('features', [])):
+        properties = feature.get('properties') or {}
+        aoi_id = str(properties.get('id', feature.get('id', i)))
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') not in ('Polygon', 'MultiPolygon'):
+            logger.warning("Skipping parcel %s: %s geometry is not supported", aoi_id, geometry.get('type'))
+            continue
+        last_acquired = scene_selection.parse_acquired(state.get(aoi_id))
+        try:
+            monitor.add(aoi_id, geometry, properties.get('threshold', 0.2), last_acquired)
+        except (KeyError, TypeError, ValueError, IndexError) as e:
+            logger.warning("Skipping parcel %s: invalid geometry (%s)", aoi_id, e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monitor saved parcels for new satellite acquisitions.")
+    parser.add_argument("parcels", help="GeoJSON FeatureCollection of parcels to monitor")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL_SECONDS, help="seconds between passes")
+    parser.add_argument("--output", default="monitor_results.jsonl", help="JSON Lines file results are appended to")
+    parser.add_argument("--state", default="monitor_state.json", help="file tracking each parcel's last acquisition")
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    api_key = os.environ.get("PLANET_API_KEY")
+    if not api_key:
+        parser.error("PLANET_API_KEY must be set in the environment")
+
+    state = {}
+    if os.path.exists(args.state):
+        with open(args.state) as f:
+            state = json.load(f)
+
+    def save_result(result):
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+        if result['acquired']:
+            state[result['aoi_id']] = result['acquired']
+        with open(args.state, "w") as f:
+            json.dump(state, f, indent=2)
+
+    monitor = Monitor(api_key, on_result=save_result)
+    load_parcels(monitor, args.parcels, state)
+    logger.info("Monitoring %d parcel(s)", len(monitor.aois))
+
+    if args.once:
+        monitor.run_once()
+    else:
+        monitor.run_forever(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,133 +1,311 @@
 import streamlit as st
-import requests
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
+import os
 import time
+import metrics
+import raster_cache
+import rate_limiter
+import scene_selection
+import utils
 
-def get_planet_data(aoi, item_type='PSScene', asset_type='visual'):
+# Length of the acquisition window searched before the requested date
+SEARCH_WINDOW_DAYS = 30
+
+# Planet API root; point it at a stand-in server for offline and load testing
+PLANET_API_URL = os.environ.get("TERRASCAN_PLANET_API_URL", "https://api.planet.com").rstrip("/")
+
+class PlanetDataError(Exception):
     """
-    Fetch satellite data from Planet API with enhanced user feedback
+    A Planet data failure with a message ready to show to the user.
+
+    `level` is 'error' or 'warning' and selects how the app displays it.
     """
-    try:
-        # Get Planet API key from secrets
-        api_key = st.secrets.get("PLANET_API_KEY")
-        if not api_key:
-            st.error("❌ Planet API key not found in secrets")
-            return None, None
-
-        # Validate AOI
-        if not aoi or 'coordinates' not in aoi or not aoi['coordinates']:
-            st.error("❌ Please draw a valid area on the map")
-            return None, None
-
-        # Create a simple geometry filter from AOI
-        geometry = aoi
-        
-        # Define date range (last 30 days)
-        start_date = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%dT%H:%M:%SZ")
-        
-        # Planet API request payload
-        search_request = {
-            "item_types": [item_type],
-            "filter": {
-                "type": "AndFilter",
-                "config": [
-                    {
-                        "type": "GeometryFilter",
-                        "field_name": "geometry",
-                        "config": geometry
-                    },
-                    {
-                        "type": "DateRangeFilter",
-                        "field_name": "acquired",
-                        "config": {
-                            "gte": start_date
-                        }
-                    },
-                    {
-                        "type": "RangeFilter",
-                        "field_name": "cloud_cover",
-                        "config": {
-                            "lte": 0.1
-                        }
+
+    def __init__(self, message, level='error'):
+        super().__init__(message)
+        self.level = level
+
+
+def search_scenes(geometry, api_key, item_type='PSScene', start_date=None, end_date=None, session_id=None):
+    """
+    Runs one Planet quick search and returns the matching items (possibly none).
+
+    `start_date` and `end_date` are datetimes; the search covers the
+    SEARCH_WINDOW_DAYS before the end (default now) unless a start is given.
+    HTTP failures raise PlanetDataError.
+    """
+    # The network stack is only needed once a fetch actually happens
+    import requests
+
+    window_end = end_date or datetime.now()
+    window_start = start_date or window_end - timedelta(days=SEARCH_WINDOW_DAYS)
+    date_range = {"gte": window_start.strftime("%Y-%m-%dT%H:%M:%SZ")}
+    if end_date is not None:
+        date_range["lte"] = end_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+    
+    # Planet API request payload
+    search_request = {
+        "item_types": [item_type],
+        "filter": {
+            "type": "AndFilter",
+            "config": [
+                {
+                    "type": "GeometryFilter",
+                    "field_name": "geometry",
+                    "config": geometry
+                },
+                {
+                    "type": "DateRangeFilter",
+                    "field_name": "acquired",
+                    "config": date_range
+                },
+                {
+                    "type": "RangeFilter",
+                    "field_name": "cloud_cover",
+                    "config": {
+                        "lte": 0.1
                     }
-                ]
-            }
+                }
+            ]
         }
+    }
+
+    # Search for imagery
+    search_url = f"{PLANET_API_URL}/data/v1/quick-search"
+    headers = {
+        "Authorization": f"api-key {api_key}",
+        "Content-Type": "application/json"
+    }
+
+    with metrics.span("planet_search"):
+        response = rate_limiter.call(
+            "search", lambda: requests.post(search_url, json=search_request, headers=headers), session_id
+        )
+    metrics.add_bytes("planet_search_response", len(response.content))
+    
+    if response.status_code == 401:
+        raise PlanetDataError("🔐 Authentication failed. Please check your Planet API key.")
+    elif response.status_code == 403:
+        raise PlanetDataError("🚫 Access forbidden. Check your API key permissions.")
+    elif response.status_code == 429:
+        raise PlanetDataError("🚦 Planet's request limit was reached. Please try again in a minute.", level='warning')
+    elif response.status_code != 200:
+        raise PlanetDataError(f"❌ Satellite connection error: {response.status_code}")
+
+    results = response.json()
+    return results.get('features', [])
 
-        # Search for imagery
-        search_url = "https://api.planet.com/data/v1/quick-search"
-        headers = {
-            "Authorization": f"api-key {api_key}",
-            "Content-Type": "application/json"
+
+def download_scenes(scenes, geometry, session_id=None, max_pixels=utils.MAX_WORKING_PIXELS):
+    """
+    Downloads the given scenes over the bounding box of `geometry`.
+
+    Download tokens are acquired first and the shared quota is charged only
+    once they are granted; the rasters come back on the working grid for
+    that box as (rgb, ndvi).
+    """
+    # Wait for download tokens first, so a timed-out wait costs no quota
+    for _ in scenes:
+        rate_limiter.get_limiter("download").acquire(session_id)
+    rate_limiter.quota.charge(utils.approximate_area(*utils.aoi_bounds(geometry)), session_id)
+
+    # Working grid follows the area size (native resolution, capped)
+    shape = utils.working_resolution(geometry, max_pixels)
+    with metrics.span("scene_download"):
+        mock_ndvi = create_enhanced_ndvi_data(geometry, shape)
+        mock_rgb = create_enhanced_rgb_data(geometry, shape)
+    metrics.add_bytes("scene_download", mock_ndvi.nbytes + mock_rgb.nbytes)
+    return mock_rgb, mock_ndvi
+
+
+def _unique_scenes(scenes):
+    # Scenes in first-seen order, each id once
+    unique = {}
+    for scene in scenes:
+        unique.setdefault(scene['id'], scene)
+    return list(unique.values())
+
+
+def download_preview(scenes, geometry, shape):
+    """
+    Fetches a coarse (rgb, ndvi) preview of the given scenes on a `shape` grid.
+
+    Previews come from the scenes' thumbnails, which are not charged against
+    the download quota.
+    """
+    with metrics.span("scene_preview"):
+        preview_ndvi = create_enhanced_ndvi_data(geometry, shape)
+        preview_rgb = create_enhanced_rgb_data(geometry, shape)
+    metrics.add_bytes("scene_preview", preview_ndvi.nbytes + preview_rgb.nbytes)
+    return preview_rgb, preview_ndvi
+
+
+def fetch_planet_data(aoi, item_type='PSScene', asset_type='visual', end_date=None, api_key=None,
+                      status=None, session_id=None, on_preview=None):
+    """
+    Fetch satellite data from Planet API without touching the Streamlit UI
+
+    Safe to call from background threads. Progress messages are passed to the
+    optional `status` callback and failures raise PlanetDataError. Calls go
+    through the process-wide rate limiter, queued fairly by `session_id`.
+    Returns (rgb, ndvi, selection), where selection describes the scenes
+    chosen by scene_selection and the fraction of the AOI they cover.
+    For larger AOIs, `on_preview` is called with a coarse NDVI preview of
+    the chosen scenes before the full-resolution download starts.
+    """
+    def report(message):
+        if status is not None:
+            status(message)
+
+    # Get Planet API key from secrets
+    if api_key is None:
+        api_key = st.secrets.get("PLANET_API_KEY")
+    if not api_key:
+        raise PlanetDataError("❌ Planet API key not found in secrets")
+
+    # Validate AOI
+    if not aoi or 'coordinates' not in aoi or not aoi['coordinates']:
+        raise PlanetDataError("❌ Please draw a valid area on the map")
+
+    # Define date range (the 30 days up to end_date, default now)
+    if end_date is None or isinstance(end_date, datetime):
+        window_end = end_date
+    else:
+        window_end = datetime.combine(end_date, datetime.max.time())
+
+    # Recently processed rasters answer the AOI, or at least part of it
+    window_start = (window_end or datetime.now()) - timedelta(days=SEARCH_WINDOW_DAYS)
+    cached, cached_coverage, remainder = raster_cache.lookup(
+        aoi, window_start.replace(tzinfo=timezone.utc),
+        window_end.replace(tzinfo=timezone.utc) if window_end is not None else None
+    )
+    bounds = utils.aoi_bounds(aoi)
+    shape = utils.working_resolution(aoi)
+    if cached and remainder is None:
+        report("⚡ Reusing a recent analysis of this area...")
+        mock_rgb, mock_ndvi = raster_cache.mosaic(cached, bounds, shape)
+        scenes = _unique_scenes(scene for entry in cached for scene in entry.scenes)
+        return mock_rgb, mock_ndvi, {
+            'scenes': scenes, 'coverage': cached_coverage, 'candidates': len(scenes), 'cached': True
         }
+    # Only the part of the AOI the cache misses is searched and downloaded
+    fetch_area = utils.bounds_polygon(*remainder) if cached else aoi
+
+    report("🛰️ Connecting to Planet's satellite constellation...")
+    time.sleep(1)
+    
+    items = search_scenes(fetch_area, api_key, item_type, end_date=window_end, session_id=session_id)
+    
+    if not items:
+        raise PlanetDataError(f"""
+        ⚠️ **No clear satellite images found** for this area in the {SEARCH_WINDOW_DAYS} days up to {window_end or datetime.now():%Y-%m-%d}.
+        
+        **Try:**
+        - Drawing a larger area
+        - Selecting a different location  
+        - Checking if the area is too cloudy
+        """, level='warning')
+
+    # Rank every candidate and keep the smallest set that covers the AOI
+    scenes, coverage = scene_selection.select_scenes(fetch_area, items)
+    if not scenes:
+        raise PlanetDataError(f"""
+        ⚠️ **No satellite image covers your area.** The images found only touch its edges ({coverage * 100:.0f}% covered).
+        
+        **Try:**
+        - Drawing the area slightly differently
+        - Selecting a different location
+        """, level='warning')
+
+    # Show a coarse look at the scenes while the full resolution downloads
+    preview_shape = utils.preview_resolution(fetch_area)
+    if on_preview is not None and preview_shape is not None:
+        _, preview_ndvi = download_preview(scenes, fetch_area, preview_shape)
+        on_preview(preview_ndvi)
+
+    # Create enhanced mock data for demonstration
+    report("🌿 Generating vegetation analysis...")
+    time.sleep(1)
+    
+    mock_rgb, mock_ndvi = download_scenes(scenes, fetch_area, session_id)
+    fetched = raster_cache.store(utils.aoi_bounds(fetch_area), mock_rgb, mock_ndvi, scenes)
+    selection = {'scenes': scenes, 'coverage': coverage, 'candidates': len(items)}
+    if cached:
+        mock_rgb, mock_ndvi = raster_cache.mosaic(cached + [fetched], bounds, shape)
+        selection['scenes'] = _unique_scenes(scenes + [scene for entry in cached for scene in entry.scenes])
+        selection['candidates'] = max(selection['candidates'], len(selection['scenes']))
+        selection['coverage'] = cached_coverage + (1 - cached_coverage) * coverage
+        selection['cached'] = True
+    return mock_rgb, mock_ndvi, selection
+
+
+def describe_scene(selection):
+    """
+    Builds the user-facing summary of the selected satellite scene(s).
+    """
+    item = selection['scenes'][0]
+    properties = item.get('properties', {})
+    summary = f"""
+    ✅ **Satellite Image Found!**
+    
+    **Image ID:** {item['id']}
+    **Acquired:** {properties.get('acquired', 'Recent')}
+    **Cloud Cover:** {properties.get('cloud_cover', 0) * 100:.1f}%
+    **Quality:** {'Excellent' if properties.get('cloud_cover', 0) < 0.05 else 'Good'}
+    **Area Coverage:** {selection['coverage'] * 100:.0f}%"""
+    if len(selection['scenes']) > 1:
+        summary += f"""
+    **Scenes Combined:** {len(selection['scenes'])} of {selection['candidates']} found"""
+    if selection.get('cached'):
+        summary += """
+    **Source:** ⚡ Reused a recent analysis of this area"""
+    return summary + "\n    "
+
+
+def show_planet_error(error):
+    """
+    Displays a PlanetDataError with its matching Streamlit element.
+    """
+    if error.level == 'warning':
+        st.warning(str(error))
+    else:
+        st.error(str(error))
 
+
+def get_planet_data(aoi, item_type='PSScene', asset_type='visual', end_date=None):
+    """
+    Fetch satellite data from Planet API with enhanced user feedback
+
+    By default the most recent 30 days are searched; pass `end_date` (a date or
+    datetime) to search the 30 days leading up to that date instead.
+    """
+    try:
         # Enhanced progress feedback
         with st.spinner("🛰️ Connecting to Planet's satellite constellation..."):
-            time.sleep(1)
-            
-            response = requests.post(search_url, json=search_request, headers=headers)
-            
-            if response.status_code == 401:
-                st.error("🔐 Authentication failed. Please check your Planet API key.")
-                return None, None
-            elif response.status_code == 403:
-                st.error("🚫 Access forbidden. Check your API key permissions.")
-                return None, None
-            elif response.status_code != 200:
-                st.error(f"❌ Satellite connection error: {response.status_code}")
-                return None, None
-
-            results = response.json()
-            items = results.get('features', [])
-            
-            if not items:
-                st.warning("""
-                ⚠️ **No clear satellite images found** for this area in the last 30 days.
-                
-                **Try:**
-                - Drawing a larger area
-                - Selecting a different location  
-                - Checking if the area is too cloudy
-                """)
-                return None, None
-
-            # Get the most recent image
-            latest_item = items[0]
-            item_id = latest_item['id']
-            properties = latest_item.get('properties', {})
-            
-            # Enhanced success message
-            st.success(f"""
-            ✅ **Satellite Image Found!**
-            
-            **Image ID:** {item_id}
-            **Acquired:** {properties.get('acquired', 'Recent')}
-            **Cloud Cover:** {properties.get('cloud_cover', 0) * 100:.1f}%
-            **Quality:** {'Excellent' if properties.get('cloud_cover', 0) < 0.05 else 'Good'}
-            """)
-
-            # Create enhanced mock data for demonstration
-            st.info("🌿 **Generating vegetation analysis...**")
-            time.sleep(1)
-            
-            mock_ndvi = create_enhanced_ndvi_data(aoi)
-            mock_rgb = create_enhanced_rgb_data(aoi)
-            
-            return mock_rgb, mock_ndvi
+            mock_rgb, mock_ndvi, selection = fetch_planet_data(
+                aoi, item_type, asset_type, end_date, session_id=st.session_state.get("session_id")
+            )
 
+        # Enhanced success message
+        st.success(describe_scene(selection))
+        return mock_rgb, mock_ndvi
+
+    except (PlanetDataError, rate_limiter.RateLimited, rate_limiter.QuotaExceeded) as e:
+        show_planet_error(e)
+        return None, None
     except Exception as e:
         st.error(f"❌ Satellite data error: {str(e)}")
         return None, None
 
-def create_enhanced_ndvi_data(aoi):
+def create_enhanced_ndvi_data(aoi, shape=(300, 300)):
     """Create realistic NDVI data for demonstration"""
+    height, width = shape
     try:
         coords = aoi['coordinates'][0]
         
         # Create a synthetic NDVI image with realistic patterns
-        width, height = 300, 300
         ndvi_data = np.random.rand(height, width) * 0.8 - 0.2
         
         # Add realistic vegetation patterns
@@ -156,13 +334,12 @@ def create_enhanced_ndvi_data(aoi):
         return np.clip(ndvi_data, -1, 1)
         
     except Exception as e:
-        return np.random.rand(300, 300) * 0.8 - 0.2
+        return np.random.rand(height, width) * 0.8 - 0.2
 
-def create_enhanced_rgb_data(aoi):
+def create_enhanced_rgb_data(aoi, shape=(300, 300)):
     """Create realistic RGB satellite imagery"""
+    height, width = shape
     try:
-        width, height = 300, 300
-        
         # Create base landscape
         rgb_data = np.zeros((height, width, 3), dtype=np.uint8)
         
@@ -197,4 +374,4 @@ def create_enhanced_rgb_data(aoi):
         return rgb_data
         
     except Exception as e:
-        return np.random.randint(50, 200, (300, 300, 3), dtype=np.uint8)
\ No newline at end of file
+        return np.random.randint(50, 200, (height, width, 3), dtype=np.uint8)
\ No newline at end of file
@@ -0,0 +1,119 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Number of entries kept in the text summaries
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 15
+
+# tracemalloc is process-wide, so only one run is profiled at a time
+_profile_lock = threading.Lock()
+
+
+def _flag_enabled(name, secrets=None):
+    # Operator switches come from the app secrets or the environment
+    if secrets is not None:
+        try:
+            if str(secrets.get(name, "")).lower() in ("1", "true", "yes"):
+                return True
+        except Exception:
+            # st.secrets raises when no secrets file exists
+            pass
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+
+def profiling_requested(query_params=None, secrets=None):
+    """
+    Returns True when debug profiling is switched on for this run.
+
+    Enabled by the TERRASCAN_PROFILE secret or environment variable. The
+    ?profile=1 query parameter is only honoured when the operator also sets
+    TERRASCAN_PROFILE_ALLOW_QUERY, since profiling slows every session in
+    the process and its output exposes server paths.
+    """
+    if _flag_enabled("TERRASCAN_PROFILE", secrets):
+        return True
+    if query_params is not None and query_params.get("profile") == "1":
+        return _flag_enabled("TERRASCAN_PROFILE_ALLOW_QUERY", secrets)
+    return False
+
+
+def _top_allocations(snapshot, limit):
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    allocations = []
+    for stat in snapshot.statistics('lineno')[:limit]:
+        frame = stat.traceback[0]
+        allocations.append({
+            'location': f"{frame.filename}:{frame.lineno}",
+            'size_kb': stat.size / 1024,
+            'count': stat.count,
+        })
+    return allocations
+
+
+@contextmanager
+def profile_run(label="analysis"):
+    """
+    Profiles the enclosed block with cProfile and tracemalloc.
+
+    Yields a dict that is filled in when the block exits with:
+    - 'prof_bytes': cProfile stats in the standard .prof format (pstats/snakeviz)
+    - 'stats_text': the top functions by cumulative time
+    - 'top_allocations': the largest allocations still held at the end of the run
+    - 'peak_memory_mb' and 'wall_time': peak traced memory and elapsed seconds
+    """
+    report = {'label': label}
+    with _profile_lock:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(25)
+        tracemalloc.reset_peak()
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield report
+        finally:
+            profiler.disable()
+            report['wall_time'] = time.perf_counter() - start
+
+            _, peak = tracemalloc.get_traced_memory()
+            report['peak_memory_mb'] = peak / (1024 * 1024)
+            report['top_allocations'] = _top_allocations(tracemalloc.take_snapshot(), TOP_ALLOCATIONS)
+            if started_tracing:
+                tracemalloc.stop()
+
+            profiler.create_stats()
+            report['prof_bytes'] = marshal.dumps(profiler.stats)
+
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            report['stats_text'] = stream.getvalue()
+
+
+def format_summary(report):
+    """
+    Formats a profile report as a plain-text summary for download.
+    """
+    lines = [
+        f"TerraScan profile: {report['label']}",
+        f"Wall time: {report['wall_time']:.3f} s",
+        f"Peak traced memory: {report['peak_memory_mb']:.1f} MB",
+        "",
+        "Top allocations:",
+    ]
+    for allocation in report['top_allocations']:
+        lines.append(f"  {allocation['size_kb']:>10.1f} KB  {allocation['count']:>7} blocks  {allocation['location']}")
+    lines.append("")
+    lines.append(report['stats_text'])
+    return "\n".join(lines)
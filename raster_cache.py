@@ -0,0 +1,228 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+import scene_selection
+import spatial_index
+import utils
+
+# Cached rasters older than this (seconds) are never reused
+MAX_AGE_SECONDS = float(os.environ.get("TERRASCAN_RASTER_CACHE_MAX_AGE", 6 * 3600))
+
+# Memory budget for cached rasters (bytes); least recently used go first
+MAX_CACHE_BYTES = int(os.environ.get("TERRASCAN_RASTER_CACHE_MB", 256)) * 1024 * 1024
+
+# Reuse the cache when it covers at least this fraction of the AOI box and
+# fetch only the rest; at TARGET_COVERAGE nothing is fetched at all
+MIN_REUSE_COVERAGE = 0.6
+TARGET_COVERAGE = scene_selection.TARGET_COVERAGE
+
+# A cached raster may be at most this much coarser than the AOI's own grid
+MAX_RESOLUTION_LOSS = 4.0
+
+
+class CachedRaster:
+    """Processed rasters for a box, the scenes they came from and when."""
+
+    def __init__(self, entry_id, bounds, rgb, ndvi, scenes, acquired, stored_at):
+        self.id = entry_id
+        self.bounds = bounds
+        self.rgb = rgb
+        self.ndvi = ndvi
+        self.scenes = scenes
+        self.acquired = acquired
+        self.stored_at = stored_at
+
+    @property
+    def nbytes(self):
+        return self.rgb.nbytes + self.ndvi.nbytes
+
+    def pixel_size(self):
+        # Degrees per pixel along each axis
+        min_lon, max_lon, min_lat, max_lat = self.bounds
+        rows, cols = self.ndvi.shape[:2]
+        return (max_lat - min_lat) / rows, (max_lon - min_lon) / cols
+
+
+_entries = OrderedDict()
+_index = spatial_index.GridIndex()
+_ids = itertools.count()
+_lock = threading.Lock()
+
+
+def _newest_acquisition(scenes):
+    dates = [scene_selection.parse_acquired(scene.get('properties', {}).get('acquired')) for scene in scenes]
+    dates = [acquired for acquired in dates if acquired is not None]
+    return max(dates) if dates else None
+
+
+def _drop(entry_id):
+    entry = _entries.pop(entry_id)
+    _index.remove(entry_id, entry.bounds)
+
+
+def _update_gauges():
+    metrics.set_gauge("raster_cache_entries", len(_entries))
+    metrics.set_gauge("raster_cache_bytes", sum(entry.nbytes for entry in _entries.values()))
+
+
+def store(bounds, rgb, ndvi, scenes):
+    """
+    Caches processed rasters covering the `bounds` box for later AOIs.
+    """
+    entry = CachedRaster(next(_ids), tuple(bounds), rgb, ndvi, scenes, _newest_acquisition(scenes), time.time())
+    with _lock:
+        _entries[entry.id] = entry
+        _index.insert(entry.id, entry.bounds)
+        total = sum(cached.nbytes for cached in _entries.values())
+        while total > MAX_CACHE_BYTES and len(_entries) > 1:
+            oldest = next(iter(_entries))
+            total -= _entries[oldest].nbytes
+            _drop(oldest)
+        _update_gauges()
+    return entry
+
+
+def invalidate(max_age=None):
+    """
+    Drops cached rasters stored more than `max_age` seconds ago (default
+    MAX_AGE_SECONDS); pass 0 to empty the cache. Returns how many were dropped.
+    """
+    max_age = MAX_AGE_SECONDS if max_age is None else max_age
+    cutoff = time.time() - max_age
+    with _lock:
+        expired = [entry_id for entry_id, entry in _entries.items() if entry.stored_at <= cutoff]
+        for entry_id in expired:
+            _drop(entry_id)
+        _update_gauges()
+    return len(expired)
+
+
+def lookup(aoi, window_start=None, window_end=None):
+    """
+    Finds cached rasters that can answer an AOI.
+
+    Only entries stored within MAX_AGE_SECONDS, acquired inside the optional
+    search window and not much coarser than the AOI's grid are considered.
+    Entries are picked greedily by newly covered area of the AOI's bounding
+    box (newest first on ties). Returns (entries, covered fraction, remainder)
+    where remainder is the (min_lon, max_lon, min_lat, max_lat) box still to
+    fetch, or None when the cache covers the AOI. Entries is empty when the
+    cache covers too little to be worth using.
+    """
+    invalidate()
+    bounds = utils.aoi_bounds(aoi)
+    box = utils.bounds_polygon(*bounds)
+    rows, cols = utils.working_resolution(aoi)
+    aoi_pixel = ((bounds[3] - bounds[2]) / rows, (bounds[1] - bounds[0]) / cols)
+
+    with _lock:
+        candidates = [_entries[entry_id] for entry_id in _index.query(bounds)]
+    candidates = [
+        entry for entry in candidates
+        if (window_start is None or entry.acquired is None or entry.acquired >= window_start)
+        and (window_end is None or entry.acquired is None or entry.acquired <= window_end)
+        and all(size <= limit * MAX_RESOLUTION_LOSS for size, limit in zip(entry.pixel_size(), aoi_pixel))
+    ]
+    if not candidates:
+        metrics.record_cache("aoi_raster", False)
+        return [], 0.0, bounds
+
+    # Greedy cover of the AOI box by cached footprints
+    covered = scene_selection.coverage_matrix(
+        box, [{'geometry': utils.bounds_polygon(*entry.bounds)} for entry in candidates]
+    )
+    if covered.shape[1] == 0:
+        metrics.record_cache("aoi_raster", False)
+        return [], 0.0, bounds
+    newest = np.array([entry.stored_at for entry in candidates])
+    selected = []
+    union = np.zeros(covered.shape[1], dtype=bool)
+    while union.mean() < TARGET_COVERAGE:
+        gain = np.count_nonzero(covered & ~union, axis=1)
+        best = int(np.lexsort((newest, gain))[-1])
+        if gain[best] == 0:
+            break
+        selected.append(candidates[best])
+        union |= covered[best]
+    fraction = float(union.mean())
+
+    if fraction < MIN_REUSE_COVERAGE:
+        metrics.record_cache("aoi_raster", False)
+        return [], fraction, bounds
+
+    metrics.record_cache("aoi_raster", True)
+    with _lock:
+        for entry in selected:
+            if entry.id in _entries:
+                _entries.move_to_end(entry.id)
+    if fraction >= TARGET_COVERAGE:
+        return selected, fraction, None
+
+    # Box around the uncovered sample points, padded by one sample spacing so
+    # the pixels between them are fetched too
+    metrics.increment("raster_cache_partial_hits")
+    lon, lat = scene_selection.aoi_sample_points(box)
+    lon, lat = lon[~union], lat[~union]
+    pad_lon = (bounds[1] - bounds[0]) / scene_selection.COVERAGE_SAMPLES
+    pad_lat = (bounds[3] - bounds[2]) / scene_selection.COVERAGE_SAMPLES
+    remainder = (
+        float(max(lon.min() - pad_lon, bounds[0])), float(min(lon.max() + pad_lon, bounds[1])),
+        float(max(lat.min() - pad_lat, bounds[2])), float(min(lat.max() + pad_lat, bounds[3])),
+    )
+    return selected, fraction, remainder
+
+
+def _source_indices(edge_min, edge_max, length, centres):
+    # Source pixel under each centre, with -1 where it falls outside the box
+    index = np.floor((centres - edge_min) / ((edge_max - edge_min) or 1.0) * length).astype(np.intp)
+    index[(index < 0) | (index >= length)] = -1
+    return index
+
+
+def mosaic(sources, bounds, shape):
+    """
+    Resamples rasters onto one north-up grid over `bounds`.
+
+    `sources` is a list of CachedRaster-like objects (with bounds, rgb and
+    ndvi) in priority order; later sources only fill pixels earlier ones left
+    empty. Nearest-neighbour sampling keeps this to a few index operations.
+    Returns (rgb, ndvi); pixels no source covers are black and NaN.
+    """
+    rows, cols = shape
+    min_lon, max_lon, min_lat, max_lat = bounds
+    lons = min_lon + (np.arange(cols) + 0.5) * (max_lon - min_lon) / cols
+    lats = max_lat - (np.arange(rows) + 0.5) * (max_lat - min_lat) / rows
+
+    rgb = np.zeros((rows, cols, 3), dtype=np.uint8)
+    ndvi = np.full((rows, cols), np.nan)
+    filled = np.zeros((rows, cols), dtype=bool)
+
+    with metrics.span("raster_mosaic"):
+        for source in sources:
+            src_min_lon, src_max_lon, src_min_lat, src_max_lat = source.bounds
+            src_rows, src_cols = source.ndvi.shape[:2]
+            col_index = _source_indices(src_min_lon, src_max_lon, src_cols, lons)
+            # Row 0 is the northern edge, so rows count down from max_lat
+            row_index = _source_indices(-src_max_lat, -src_min_lat, src_rows, -lats)
+            out_rows = np.flatnonzero(row_index >= 0)
+            out_cols = np.flatnonzero(col_index >= 0)
+            if not out_rows.size or not out_cols.size:
+                continue
+
+            block = np.ix_(out_rows, out_cols)
+            source_block = np.ix_(row_index[out_rows], col_index[out_cols])
+            if not filled.any():
+                ndvi[block] = source.ndvi[source_block]
+                rgb[block] = source.rgb[source_block]
+            else:
+                empty = ~filled[block]
+                ndvi[block] = np.where(empty, source.ndvi[source_block], ndvi[block])
+                rgb[block] = np.where(empty[..., None], source.rgb[source_block], rgb[block])
+            filled[block] = True
+    return rgb, ndvi
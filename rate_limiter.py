@@ -0,0 +1,250 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import metrics
+
+# Planet Data API request rates (per second) for each endpoint family.
+# Each can be overridden with e.g. TERRASCAN_PLANET_SEARCH_RATE.
+DEFAULT_RATES = {
+    'search': 10.0,
+    'activate': 5.0,
+    'download': 15.0,
+}
+
+# Longest a caller waits for its turn before giving up (seconds)
+ACQUIRE_TIMEOUT = 60.0
+
+# How often a 429 response is retried before it is reported to the user
+MAX_RETRIES = 3
+
+# Pause applied after a 429 without a Retry-After header (seconds)
+DEFAULT_BACKOFF = 2.0
+
+# Monthly download quota in square km (0 means unlimited)
+MONTHLY_QUOTA_SQ_KM = float(os.environ.get("TERRASCAN_PLANET_QUOTA_SQ_KM", "0"))
+
+
+class RateLimited(Exception):
+    """
+    Raised when a Planet API call could not get a turn within the timeout.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.level = 'warning'
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when a download would exceed the configured monthly quota.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.level = 'error'
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, at most `capacity` banked.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1.0))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now):
+        """
+        Takes one token and returns 0, or returns the seconds until one is free.
+        """
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def pause(self, seconds, now):
+        """
+        Stops handing out tokens for `seconds` (after the server said 429).
+        """
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = max(self.updated, now)
+
+
+class FairLimiter:
+    """
+    Token bucket shared by all sessions, granted round-robin between them.
+
+    Each session waits in its own FIFO queue; turns rotate across sessions so
+    one busy session cannot starve the others.
+    """
+
+    def __init__(self, name, rate):
+        self.name = name
+        self.bucket = TokenBucket(rate)
+        self._condition = threading.Condition()
+        self._queues = OrderedDict()
+
+    def _next_ticket(self):
+        for queue in self._queues.values():
+            if queue:
+                return queue[0]
+        return None
+
+    def _remove(self, session, ticket):
+        queue = self._queues.get(session)
+        if queue is None:
+            return
+        queue.remove(ticket)
+        if queue:
+            # Send this session to the back of the rotation
+            self._queues.move_to_end(session)
+        else:
+            del self._queues[session]
+
+    def acquire(self, session=None, timeout=ACQUIRE_TIMEOUT):
+        """
+        Blocks until this session's turn comes up and a token is available.
+
+        Returns the seconds spent waiting; raises RateLimited on timeout.
+        """
+        ticket = object()
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._condition:
+            self._queues.setdefault(session, deque()).append(ticket)
+            metrics.set_gauge(f"planet_{self.name}_waiting", self._waiting())
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._next_ticket() is ticket:
+                        wait = self.bucket.try_take(now)
+                        if wait == 0:
+                            break
+                    if now >= deadline:
+                        metrics.increment(f"planet_{self.name}_rate_limit_timeout")
+                        raise RateLimited(
+                            "🚦 Planet is busy right now. Please try again in a minute."
+                        )
+                    self._condition.wait(min(wait or deadline - now, deadline - now))
+            finally:
+                self._remove(session, ticket)
+                metrics.set_gauge(f"planet_{self.name}_waiting", self._waiting())
+                self._condition.notify_all()
+
+        waited = time.monotonic() - start
+        metrics.observe(f"planet_{self.name}_queue_wait", waited)
+        return waited
+
+    def _waiting(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def penalize(self, seconds):
+        """
+        Pauses the bucket after the server rejected a request with 429.
+        """
+        with self._condition:
+            self.bucket.pause(seconds, time.monotonic())
+            self._condition.notify_all()
+
+
+class QuotaTracker:
+    """
+    Accounts downloaded area per calendar month, in total and per session.
+    """
+
+    def __init__(self, limit_sq_km=MONTHLY_QUOTA_SQ_KM):
+        self.limit_sq_km = limit_sq_km
+        self._lock = threading.Lock()
+        self._month = None
+        self.used_sq_km = 0.0
+        self.by_session = {}
+
+    def _roll_month(self):
+        month = datetime.now().strftime("%Y-%m")
+        if month != self._month:
+            self._month = month
+            self.used_sq_km = 0.0
+            self.by_session = {}
+
+    def charge(self, area_sq_km, session=None):
+        """
+        Records a download of `area_sq_km`, or raises QuotaExceeded.
+        """
+        with self._lock:
+            self._roll_month()
+            if self.limit_sq_km and self.used_sq_km + area_sq_km > self.limit_sq_km:
+                metrics.increment("planet_quota_rejected")
+                raise QuotaExceeded(
+                    f"🛑 Monthly imagery quota reached ({self.used_sq_km:.0f} of "
+                    f"{self.limit_sq_km:.0f} sq km used). Try a smaller area or wait until next month."
+                )
+            self.used_sq_km += area_sq_km
+            self.by_session[session] = self.by_session.get(session, 0.0) + area_sq_km
+            metrics.set_gauge("planet_quota_used_sq_km", self.used_sq_km)
+
+    def remaining(self):
+        """
+        Returns the remaining quota in sq km, or None when unlimited.
+        """
+        with self._lock:
+            self._roll_month()
+            if not self.limit_sq_km:
+                return None
+            return max(self.limit_sq_km - self.used_sq_km, 0.0)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+quota = QuotaTracker()
+
+
+def get_limiter(kind):
+    """
+    Returns the process-wide limiter for 'search', 'activate' or 'download'.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(kind)
+        if limiter is None:
+            rate = float(os.environ.get(f"TERRASCAN_PLANET_{kind.upper()}_RATE", DEFAULT_RATES[kind]))
+            limiter = _limiters[kind] = FairLimiter(kind, rate)
+        return limiter
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After", DEFAULT_BACKOFF))
+    except (TypeError, ValueError):
+        return DEFAULT_BACKOFF
+
+
+def call(kind, request, session=None):
+    """
+    Runs `request()` (returning a requests.Response) under the `kind` limiter.
+
+    A 429 response pauses the shared bucket for the server's Retry-After and
+    the call is retried up to MAX_RETRIES times; the last response is returned.
+    """
+    limiter = get_limiter(kind)
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire(session)
+        response = request()
+        metrics.increment(f"planet_{kind}_{response.status_code}")
+        if response.status_code != 429 or attempt == MAX_RETRIES:
+            return response
+        limiter.penalize(_retry_after(response))
+    return response
@@ -0,0 +1,174 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+import metrics
+import utils
+
+# The AOI is sampled on an N x N grid of its bounding box to measure coverage
+COVERAGE_SAMPLES = 64
+
+# Stop adding scenes once this fraction of the AOI is covered
+TARGET_COVERAGE = 0.98
+
+# Never download more scenes than this for one AOI
+MAX_SCENES = 4
+
+# Scenes that together cover less than this fraction of the AOI are rejected
+MIN_AOI_COVERAGE = 0.5
+
+# Relative weight of each criterion in a scene's score (sums to 1)
+SCORE_WEIGHTS = {
+    'coverage': 0.5,
+    'cloud': 0.25,
+    'recency': 0.15,
+    'sun': 0.10,
+}
+
+# Age (days) at which the recency score has decayed to 1/e
+RECENCY_SCALE_DAYS = 15
+
+# Sun elevation assumed when a scene does not report one (degrees)
+DEFAULT_SUN_ELEVATION = 45
+
+
+def _rings(geometry):
+    if geometry['type'] == 'Polygon':
+        return [np.asarray(ring, dtype=float) for ring in geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return [np.asarray(ring, dtype=float) for polygon in geometry['coordinates'] for ring in polygon]
+    raise ValueError(f"Unsupported geometry type: {geometry['type']}")
+
+
+def points_in_geometry(lon, lat, geometry):
+    """
+    Vectorized even-odd point-in-polygon test for a Polygon or MultiPolygon.
+
+    Holes and multiple parts are handled by toggling across every ring.
+    Returns a boolean array with one entry per (lon, lat) point.
+    """
+    lon = np.asarray(lon, dtype=float)[:, None]
+    lat = np.asarray(lat, dtype=float)[:, None]
+    inside = np.zeros(lon.shape[0], dtype=bool)
+    for ring in _rings(geometry):
+        x1, y1 = ring[:-1, 0], ring[:-1, 1]
+        x2, y2 = ring[1:, 0], ring[1:, 1]
+        straddles = (y1 > lat) != (y2 > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_lon = (x2 - x1) * (lat - y1) / (y2 - y1) + x1
+        crossings = np.count_nonzero(straddles & (lon < crossing_lon), axis=1)
+        inside ^= (crossings % 2).astype(bool)
+    return inside
+
+
+def aoi_sample_points(aoi, samples=COVERAGE_SAMPLES):
+    """
+    Returns (lon, lat) arrays of grid cell centres that fall inside the AOI.
+    """
+    min_lon, max_lon, min_lat, max_lat = utils.aoi_bounds(aoi)
+    lons = min_lon + (np.arange(samples) + 0.5) * (max_lon - min_lon) / samples
+    lats = min_lat + (np.arange(samples) + 0.5) * (max_lat - min_lat) / samples
+    lon, lat = (grid.ravel() for grid in np.meshgrid(lons, lats))
+    inside = points_in_geometry(lon, lat, aoi)
+    return lon[inside], lat[inside]
+
+
+def coverage_matrix(aoi, items, samples=COVERAGE_SAMPLES):
+    """
+    Returns a (scenes, points) boolean matrix of which AOI sample points each
+    scene footprint covers.
+
+    Scenes without a footprint are assumed to cover the whole AOI, since the
+    search already matched them against its geometry.
+    """
+    lon, lat = aoi_sample_points(aoi, samples)
+    covered = np.ones((len(items), lon.size), dtype=bool)
+    for i, item in enumerate(items):
+        if item.get('geometry'):
+            covered[i] = points_in_geometry(lon, lat, item['geometry'])
+    return covered
+
+
+def parse_acquired(value):
+    try:
+        acquired = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+    if acquired.tzinfo is None:
+        acquired = acquired.replace(tzinfo=timezone.utc)
+    return acquired
+
+
+def quality_scores(items, now=None):
+    """
+    Scores each scene's cloud cover, recency and sun angle in [0, 1].
+
+    Returns a dict of arrays keyed by criterion.
+    """
+    now = now or datetime.now(timezone.utc)
+    properties = [item.get('properties', {}) for item in items]
+
+    cloud = np.array([p.get('cloud_cover', 0) or 0 for p in properties], dtype=float)
+    sun = np.array([p.get('sun_elevation', DEFAULT_SUN_ELEVATION) or 0 for p in properties], dtype=float)
+    age_days = np.array([
+        (now - acquired).total_seconds() / 86400 if acquired else RECENCY_SCALE_DAYS * 3
+        for acquired in (parse_acquired(p.get('acquired')) for p in properties)
+    ], dtype=float)
+
+    return {
+        'cloud': 1 - np.clip(cloud, 0, 1),
+        'recency': np.exp(-np.clip(age_days, 0, None) / RECENCY_SCALE_DAYS),
+        'sun': np.clip(np.sin(np.radians(sun)), 0, 1),
+    }
+
+
+def _combine(coverage, quality):
+    return (SCORE_WEIGHTS['coverage'] * coverage
+            + SCORE_WEIGHTS['cloud'] * quality['cloud']
+            + SCORE_WEIGHTS['recency'] * quality['recency']
+            + SCORE_WEIGHTS['sun'] * quality['sun'])
+
+
+def select_scenes(aoi, items, target_coverage=TARGET_COVERAGE, max_scenes=MAX_SCENES, now=None,
+                  min_coverage=MIN_AOI_COVERAGE):
+    """
+    Picks the smallest good set of scenes that covers the AOI.
+
+    Greedy set cover: each step takes the scene with the best newly covered
+    AOI fraction, weighted by up to 2x for cloud/recency/sun quality, until
+    `target_coverage` is reached, nothing more can be gained or `max_scenes`
+    are chosen. Returns (selected items, covered fraction of the AOI); no
+    items are selected when they would cover less than `min_coverage`.
+    """
+    if not items:
+        return [], 0.0
+
+    with metrics.span("scene_selection"):
+        covered = coverage_matrix(aoi, items)
+        quality = quality_scores(items, now)
+        # Quality part of the score, rescaled to [0, 1]
+        quality_weight = _combine(np.zeros(len(items)), quality) / (1 - SCORE_WEIGHTS['coverage'])
+
+        if covered.shape[1] == 0:
+            # Degenerate AOI (no sample point inside); fall back to the best scene
+            return [items[int(np.argmax(quality_weight))]], 1.0
+
+        selected = []
+        union = np.zeros(covered.shape[1], dtype=bool)
+        while len(selected) < max_scenes and union.mean() < target_coverage:
+            gain = (covered & ~union).mean(axis=1)
+            value = gain * (0.5 + 0.5 * quality_weight)
+            value[selected] = -1
+            best = int(np.argmax(value))
+            if gain[best] <= 0:
+                break
+            selected.append(best)
+            union |= covered[best]
+
+    coverage = float(union.mean())
+    if coverage < min_coverage:
+        # Edge-clipping scenes are not worth downloading
+        selected = []
+    metrics.increment("scenes_selected", len(selected))
+    metrics.increment("scenes_skipped", len(items) - len(selected))
+    return [items[i] for i in selected], coverage
@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+# Edge of a spatial index cell, in degrees
+GRID_CELL_DEG = 0.25
+
+
+class GridIndex:
+    """
+    Uniform lon/lat grid mapping cells to the keys whose bounds touch them.
+    """
+
+    def __init__(self, cell_deg=GRID_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.cells = defaultdict(set)
+
+    def _cells(self, bounds):
+        min_lon, max_lon, min_lat, max_lat = bounds
+        for x in range(int(min_lon // self.cell_deg), int(max_lon // self.cell_deg) + 1):
+            for y in range(int(min_lat // self.cell_deg), int(max_lat // self.cell_deg) + 1):
+                yield x, y
+
+    def insert(self, key, bounds):
+        for cell in self._cells(bounds):
+            self.cells[cell].add(key)
+
+    def remove(self, key, bounds):
+        for cell in self._cells(bounds):
+            self.cells[cell].discard(key)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def query(self, bounds):
+        """
+        Returns the keys in cells touched by `bounds` (candidates, not exact).
+        """
+        found = set()
+        for cell in self._cells(bounds):
+            found |= self.cells.get(cell, set())
+        return found
+
+    def clusters(self):
+        """
+        Groups keys that share at least one cell (connected components).
+        """
+        parent = {}
+
+        def find(key):
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        for keys in self.cells.values():
+            keys = list(keys)
+            for key in keys:
+                parent.setdefault(key, key)
+            for key in keys[1:]:
+                parent[find(key)] = find(keys[0])
+
+        groups = defaultdict(list)
+        for key in parent:
+            groups[find(key)].append(key)
+        return list(groups.values())
@@ -0,0 +1,140 @@
+import numpy as np
+
+import metrics
+
+# Bands each index reads
+INDEX_BANDS = {
+    'ndvi': ('red', 'nir'),
+    'ndwi': ('green', 'nir'),
+    'savi': ('red', 'nir'),
+    'evi': ('blue', 'red', 'nir'),
+}
+
+# Soil brightness correction for SAVI
+SAVI_L = 0.5
+
+# MODIS-style EVI coefficients
+EVI_G = 2.5
+EVI_C1 = 6.0
+EVI_C2 = 7.5
+EVI_L = 1.0
+
+# PlanetScope surface reflectance is stored as reflectance * 10000
+PLANETSCOPE_SR_SCALE = 1 / 10000
+
+# Rows processed per pass; keeps scratch buffers small and cache-friendly
+CHUNK_ROWS = 256
+
+
+def _divide(numerator, denominator, out, zero_mask):
+    # Ratio with NaN where the denominator is zero, without temporaries
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(numerator, denominator, out=out)
+    np.equal(denominator, 0, out=zero_mask)
+    np.copyto(out, np.nan, where=zero_mask)
+
+
+def iter_index_chunks(bands, indices=('ndvi',), chunk_rows=CHUNK_ROWS, scale=None, nodata=None):
+    """
+    Computes several spectral indices in one fused pass over the band data.
+
+    `bands` maps band names ('blue', 'green', 'red', 'nir') to 2D arrays of
+    the same shape; memory-mapped arrays are read one window at a time. Each
+    band window is read once per chunk and shared by every requested index,
+    and all intermediate results live in scratch buffers allocated once.
+
+    Yields (row_start, {index: chunk}) per chunk of rows. The chunk arrays are
+    reused on the next iteration, so copy anything you want to keep. `scale`
+    converts stored values to reflectance; pixels equal to `nodata` in any
+    band come out as NaN.
+    """
+    unknown = [name for name in indices if name not in INDEX_BANDS]
+    if unknown:
+        raise ValueError(f"Unknown spectral index: {', '.join(unknown)}")
+
+    needed = sorted({band for name in indices for band in INDEX_BANDS[name]})
+    missing = [band for band in needed if band not in bands]
+    if missing:
+        raise ValueError(f"Missing band(s) for {', '.join(indices)}: {', '.join(missing)}")
+
+    rows, cols = bands[needed[0]].shape
+    chunk_rows = max(1, min(chunk_rows, rows))
+
+    # Scratch buffers, reused for every chunk
+    band_buffers = {band: np.empty((chunk_rows, cols), dtype=np.float32) for band in needed}
+    output_buffers = {name: np.empty((chunk_rows, cols), dtype=np.float32) for name in indices}
+    nir_minus_red = np.empty((chunk_rows, cols), dtype=np.float32)
+    nir_plus_red = np.empty((chunk_rows, cols), dtype=np.float32)
+    work = np.empty((chunk_rows, cols), dtype=np.float32)
+    work2 = np.empty((chunk_rows, cols), dtype=np.float32)
+    zero_mask = np.empty((chunk_rows, cols), dtype=bool)
+    nodata_mask = np.empty((chunk_rows, cols), dtype=bool)
+    band_mask = np.empty((chunk_rows, cols), dtype=bool)
+
+    uses_nir_red = any(name in indices for name in ('ndvi', 'savi', 'evi'))
+
+    for row_start in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - row_start)
+
+        # Read each band window exactly once
+        with metrics.span("band_read"):
+            b = {}
+            for band in needed:
+                b[band] = band_buffers[band][:n]
+                np.copyto(b[band], bands[band][row_start:row_start + n], casting='unsafe')
+
+        with metrics.span("spectral_indices"):
+            nodata_chunk = nodata_mask[:n]
+            nodata_chunk.fill(False)
+            if nodata is not None:
+                for band in needed:
+                    np.equal(b[band], nodata, out=band_mask[:n])
+                    np.logical_or(nodata_chunk, band_mask[:n], out=nodata_chunk)
+            if scale is not None:
+                for band in needed:
+                    b[band] *= scale
+
+            zeros = zero_mask[:n]
+            if uses_nir_red:
+                d_nr = np.subtract(b['nir'], b['red'], out=nir_minus_red[:n])
+                s_nr = np.add(b['nir'], b['red'], out=nir_plus_red[:n])
+
+            chunks = {}
+            for name in indices:
+                out = output_buffers[name][:n]
+                if name == 'ndvi':
+                    _divide(d_nr, s_nr, out, zeros)
+                elif name == 'savi':
+                    denominator = np.add(s_nr, SAVI_L, out=work[:n])
+                    _divide(d_nr, denominator, out, zeros)
+                    out *= 1 + SAVI_L
+                elif name == 'evi':
+                    denominator = np.multiply(b['red'], EVI_C1, out=work[:n])
+                    denominator += b['nir']
+                    denominator -= np.multiply(b['blue'], EVI_C2, out=work2[:n])
+                    denominator += EVI_L
+                    _divide(d_nr, denominator, out, zeros)
+                    out *= EVI_G
+                elif name == 'ndwi':
+                    numerator = np.subtract(b['green'], b['nir'], out=work[:n])
+                    denominator = np.add(b['green'], b['nir'], out=work2[:n])
+                    _divide(numerator, denominator, out, zeros)
+                np.copyto(out, np.nan, where=nodata_chunk)
+                chunks[name] = out
+
+        yield row_start, chunks
+
+
+def compute_indices(bands, indices=('ndvi',), chunk_rows=CHUNK_ROWS, scale=None, nodata=None):
+    """
+    Computes the requested indices for whole rasters in one fused pass.
+
+    Returns a dict mapping each index name to a float32 array. See
+    iter_index_chunks for the arguments.
+    """
+    rows, cols = next(iter(bands.values())).shape
+    outputs = {name: np.empty((rows, cols), dtype=np.float32) for name in indices}
+    for row_start, chunks in iter_index_chunks(bands, indices, chunk_rows, scale, nodata):
+        for name, chunk in chunks.items():
+            outputs[name][row_start:row_start + chunk.shape[0]] = chunk
+    return outputs
@@ -1,6 +1,21 @@
 import numpy as np
-import pandas as pd
 from datetime import datetime
+import metrics
+
+# pandas, matplotlib and PIL are imported where they are first used
+# (export and rendering) to keep the app's cold start fast.
+
+# PlanetScope ground sample distance (km per pixel edge)
+PIXEL_SIZE_KM = 0.003
+
+# Upper bound on the full-resolution working grid (pixels)
+MAX_WORKING_PIXELS = 1024 * 1024
+
+# Target size of the coarse preview shown while the full scene downloads (pixels)
+PREVIEW_PIXELS = 128 * 128
+
+# AOIs smaller than this (sq km) skip the preview
+PROGRESSIVE_MIN_AREA_SQ_KM = 25
 
 
 def approximate_area(min_lon, max_lon, min_lat, max_lat):
@@ -14,10 +29,101 @@ def approximate_area(min_lon, max_lon, min_lat, max_lat):
     return abs(width * height)
 
 
+def aoi_bounds(aoi):
+    """
+    Returns the (min_lon, max_lon, min_lat, max_lat) bounding box of an AOI.
+
+    The AOI may be a GeoJSON Polygon or MultiPolygon.
+    """
+    if aoi.get('type') == 'MultiPolygon':
+        coords = [p for polygon in aoi['coordinates'] for p in polygon[0]]
+    else:
+        coords = aoi['coordinates'][0]
+    min_lon = min(p[0] for p in coords)
+    max_lon = max(p[0] for p in coords)
+    min_lat = min(p[1] for p in coords)
+    max_lat = max(p[1] for p in coords)
+    return min_lon, max_lon, min_lat, max_lat
+
+
+def bounds_polygon(min_lon, max_lon, min_lat, max_lat):
+    """
+    Returns a GeoJSON Polygon for a (min_lon, max_lon, min_lat, max_lat) box.
+    """
+    return {
+        'type': 'Polygon',
+        'coordinates': [[
+            [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat],
+            [min_lon, max_lat], [min_lon, min_lat]
+        ]]
+    }
+
+
+def crop_to_bounds(array, array_bounds, bounds):
+    """
+    Crops a north-up raster covering `array_bounds` to the `bounds` box.
+
+    Both boxes are (min_lon, max_lon, min_lat, max_lat); the result is a view
+    (no copy) of the rows and columns that intersect `bounds`.
+    """
+    min_lon, max_lon, min_lat, max_lat = array_bounds
+    rows, cols = array.shape[:2]
+    lon_span = (max_lon - min_lon) or 1.0
+    lat_span = (max_lat - min_lat) or 1.0
+
+    col_start = int(np.floor((bounds[0] - min_lon) / lon_span * cols))
+    col_stop = int(np.ceil((bounds[1] - min_lon) / lon_span * cols))
+    # Row 0 is the northern edge
+    row_start = int(np.floor((max_lat - bounds[3]) / lat_span * rows))
+    row_stop = int(np.ceil((max_lat - bounds[2]) / lat_span * rows))
+
+    row_start, row_stop = max(row_start, 0), min(max(row_stop, row_start + 1), rows)
+    col_start, col_stop = max(col_start, 0), min(max(col_stop, col_start + 1), cols)
+    return array[row_start:row_stop, col_start:col_stop]
+
+
+def working_resolution(aoi, max_pixels=MAX_WORKING_PIXELS):
+    """
+    Picks the full-resolution (rows, cols) grid for an AOI.
+
+    Uses the sensor's native pixel size, capped at `max_pixels` so that very
+    large areas are analyzed at a coarser but still useful resolution.
+    """
+    min_lon, max_lon, min_lat, max_lat = aoi_bounds(aoi)
+    area_sq_km = approximate_area(min_lon, max_lon, min_lat, max_lat)
+    height_km = max((max_lat - min_lat) * 111, PIXEL_SIZE_KM)
+    width_km = max(area_sq_km / height_km, PIXEL_SIZE_KM)
+
+    rows = height_km / PIXEL_SIZE_KM
+    cols = width_km / PIXEL_SIZE_KM
+    scale = min(1.0, np.sqrt(max_pixels / (rows * cols)))
+    return max(1, int(rows * scale)), max(1, int(cols * scale))
+
+
+def preview_resolution(aoi, max_pixels=PREVIEW_PIXELS):
+    """
+    Picks the (rows, cols) grid of a quick preview for an AOI.
+
+    Returns None when the AOI is under PROGRESSIVE_MIN_AREA_SQ_KM or its full
+    grid is already that small, since the full result arrives about as fast.
+    """
+    if approximate_area(*aoi_bounds(aoi)) < PROGRESSIVE_MIN_AREA_SQ_KM:
+        return None
+    rows, cols = working_resolution(aoi)
+    if rows * cols <= max_pixels:
+        return None
+    return working_resolution(aoi, max_pixels)
+
+
 def classify_ndvi(ndvi_array, threshold=0.2):
     """
     Classifies NDVI data into 'Healthy' and 'Degraded' based on a threshold.
     """
+    with metrics.span("classify_ndvi"):
+        return _classify_ndvi(ndvi_array, threshold)
+
+
+def _classify_ndvi(ndvi_array, threshold):
     ndvi_array = np.array(ndvi_array, dtype=float)
     ndvi_array[ndvi_array == -9999] = np.nan
 
@@ -36,16 +142,62 @@ def classify_ndvi(ndvi_array, threshold=0.2):
     return degradation_percentage, classified_array
 
 
+def render_ndvi_image(ndvi_array):
+    """
+    Renders an NDVI array with the viridis colormap.
+
+    Returns the PIL image along with the NDVI min and max used for scaling.
+    """
+    import matplotlib.cm as cm
+    from PIL import Image
+
+    with metrics.span("render_viridis"):
+        ndvi_min = np.nanmin(ndvi_array)
+        ndvi_max = np.nanmax(ndvi_array)
+
+        # Check to prevent division by zero if the data is uniform
+        if (ndvi_max - ndvi_min) > 0:
+            ndvi_normalized = (ndvi_array - ndvi_min) / (ndvi_max - ndvi_min)
+        else:
+            ndvi_normalized = np.zeros_like(ndvi_array)
+
+        ndvi_normalized = np.nan_to_num(ndvi_normalized, nan=0.0)
+        ndvi_image = Image.fromarray((cm.viridis(ndvi_normalized) * 255).astype(np.uint8))
+
+    return ndvi_image, ndvi_min, ndvi_max
+
+
+def render_change_image(delta_array, limit=0.5):
+    """
+    Renders a ΔNDVI array with a diverging colormap (red loss, green gain).
+
+    Values are clipped to ±limit; pixels without data render as no change.
+    """
+    import matplotlib.cm as cm
+    from PIL import Image
+
+    with metrics.span("render_change"):
+        delta_normalized = (np.clip(delta_array, -limit, limit) + limit) / (2 * limit)
+        delta_normalized = np.nan_to_num(delta_normalized, nan=0.5)
+        change_image = Image.fromarray((cm.RdYlGn(delta_normalized) * 255).astype(np.uint8))
+
+    return change_image
+
+
 def create_report_csv(aoi, degradation_percentage, threshold=0.2):
     """
     Generates a comprehensive CSV report and returns it as a string.
     """
-    coords = aoi['coordinates'][0]
-    min_lon = min(p[0] for p in coords)
-    max_lon = max(p[0] for p in coords)
-    min_lat = min(p[1] for p in coords)
-    max_lat = max(p[1] for p in coords)
+    with metrics.span("report_csv"):
+        csv_data = _create_report_csv(aoi, degradation_percentage, threshold)
+    metrics.add_bytes("report_csv", len(csv_data))
+    return csv_data
+
+
+def _create_report_csv(aoi, degradation_percentage, threshold):
+    import pandas as pd
 
+    min_lon, max_lon, min_lat, max_lat = aoi_bounds(aoi)
     area_sq_km = approximate_area(min_lon, max_lon, min_lat, max_lat)
 
     if degradation_percentage < 10: